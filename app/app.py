@@ -1,33 +1,35 @@
 import os
+import hashlib
 import dash
 import dash_bootstrap_components as dbc
-from flask import Flask, send_from_directory, abort
+import hmac
+from flask import Flask, Response, request, send_from_directory, abort, jsonify
+from werkzeug.exceptions import HTTPException
 from config import IMAGE_DIRECTORIES
 from layout import create_layout
 from callbacks import register_callbacks
+from utils import precompute_image_urls, get_image_url, extract_image_tags, get_cache_data
+from cache_snapshot import open_snapshot
+from cache_index import get_cache_index
+from cache_stats import get_entry_status
+from image_index import load_image_index
+from cache_gc import start_gc_scheduler
+from profiler import (instrument_dash_app, enable_profiling, disable_profiling, get_profile_report,
+                      get_folded_stacks)
 from urllib.parse import unquote
 import logging
 import json
-from config import CACHE_FILE
+from config import ADMIN_TOKEN
+
+# API分页配置
+API_DEFAULT_LIMIT = 100
+API_MAX_LIMIT = 1000
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def load_cache_data():
-    """
-    加载缓存数据
-    
-    Returns:
-        dict: 缓存数据
-    """
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-
 def serve_image(filename):
     """
     为多个图片目录提供静态资源服务
@@ -43,30 +45,178 @@ def serve_image(filename):
         decoded_filename = unquote(filename)
         logger.info(f"收到静态资源请求: filename={decoded_filename}")
         
-        # 方法1: 通过读取缓存文件将MD5文件名转换为真实路径
-        cache_data = load_cache_data()
-        for real_path, data in cache_data.items():
-            md5_path = data.get("md5_path", "")
-            if md5_path == decoded_filename:
-                # 验证文件是否存在
-                if os.path.exists(real_path) and os.path.isfile(real_path):
-                    # 找到匹配的MD5映射，使用真实路径提供文件
-                    directory = os.path.dirname(real_path)
-                    basename = os.path.basename(real_path)
-                    logger.info(f"通过MD5映射找到资源: md5_path={decoded_filename}, real_path={real_path}")
-                    return send_from_directory(directory, basename)
-                else:
-                    logger.warning(f"MD5映射找到但文件不存在: md5_path={decoded_filename}, real_path={real_path}")
+        # 方法1: 通过缓存索引将MD5文件名转换为真实路径
+        real_path = get_cache_index().get_by_md5_path(decoded_filename)
+        if real_path:
+            # 验证文件是否存在
+            if os.path.exists(real_path) and os.path.isfile(real_path):
+                # 找到匹配的MD5映射，使用真实路径提供文件
+                directory = os.path.dirname(real_path)
+                basename = os.path.basename(real_path)
+                logger.info(f"通过MD5映射找到资源: md5_path={decoded_filename}, real_path={real_path}")
+                return send_from_directory(directory, basename)
+            else:
+                logger.warning(f"MD5映射找到但文件不存在: md5_path={decoded_filename}, real_path={real_path}")
 
-        
         # 如果在所有地方都找不到文件，返回404
         logger.warning(f"静态资源未找到: filename={decoded_filename}, 搜索目录={IMAGE_DIRECTORIES}")
         abort(404)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"静态资源服务异常: {str(e)}")
         abort(500)
 
 
+def _image_item(image_path: str, md5: str, data: dict, image_index: dict) -> dict:
+    """
+    将缓存条目转换为API返回的数据格式
+    """
+    return {
+        "md5": md5,
+        "path": image_path,
+        "url": get_image_url(image_path, {image_path: data}, image_index),
+        "labels": data.get("labels", ""),
+        "tags": extract_image_tags(data.get("labels", "")),
+        "status": get_entry_status(data),
+        "token_usage": data.get("token_usage", {})
+    }
+
+
+def _json_response(body, etag: str, generation: int) -> Response:
+    """
+    构造带ETag的JSON响应，客户端ETag未变化时返回304
+    
+    Args:
+        body: 响应内容，可以是字符串或生成器（流式输出）
+        etag (str): 实体标签
+        generation (int): 缓存索引版本
+        
+    Returns:
+        Response: Flask响应
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers["X-Cache-Generation"] = str(generation)
+    return response
+
+
+def api_images():
+    """
+    分页获取图片列表，支持按标签过滤
+    
+    查询参数: tag（标签）、cursor（上一页返回的next_cursor）、limit（每页数量，默认100，最大1000）
+    
+    Returns:
+        流式JSON响应
+    """
+    tag = request.args.get("tag") or None
+    cursor = request.args.get("cursor") or None
+    try:
+        limit = int(request.args.get("limit", API_DEFAULT_LIMIT))
+    except ValueError:
+        abort(400)
+    if not 0 < limit <= API_MAX_LIMIT:
+        abort(400)
+    
+    # 生成器在返回响应之后才执行，使用固定的索引副本，流式输出期间索引重建不影响本页内容
+    index = get_cache_index().pinned()
+    md5_list, next_cursor = index.page(tag, cursor, limit)
+    image_index = load_image_index()
+    
+    def generate():
+        yield '{"items": ['
+        first = True
+        for md5 in md5_list:
+            item = index.get(md5)
+            if item is None:
+                continue
+            yield ('' if first else ',') + json.dumps(_image_item(item[0], md5, item[1], image_index), ensure_ascii=False)
+            first = False
+        yield f'], "next_cursor": {json.dumps(next_cursor)}, "generation": {index.generation}}}'
+    
+    # 同一URL在缓存未变化时返回相同内容，ETag使用缓存版本即可
+    return _json_response(generate(), index.etag, index.generation)
+
+
+def api_image(md5):
+    """
+    获取单张图片的信息
+    
+    Args:
+        md5 (str): 图片MD5（不带扩展名）
+        
+    Returns:
+        JSON响应或404错误
+    """
+    index = get_cache_index()
+    item = index.get(md5)
+    if item is None:
+        abort(404)
+    body = json.dumps(_image_item(item[0], md5, item[1], load_image_index()), ensure_ascii=False)
+    # 单张图片的ETag只随该图片内容变化
+    etag = hashlib.md5(body.encode('utf-8')).hexdigest()
+    return _json_response(body, etag, index.generation)
+
+
+def api_tags():
+    """
+    获取所有标签及其图片数量
+    
+    Returns:
+        JSON响应
+    """
+    index = get_cache_index()
+    body = json.dumps({"tags": index.tag_counts(), "generation": index.generation}, ensure_ascii=False)
+    return _json_response(body, index.etag, index.generation)
+
+
+def _require_admin() -> None:
+    """
+    校验管理接口令牌，未配置ADMIN_TOKEN时管理接口不开放
+    """
+    if not ADMIN_TOKEN:
+        abort(404)
+    # 按字节比较：compare_digest对含非ASCII字符的字符串会抛出TypeError
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        abort(403)
+
+
+def admin_profiling():
+    """
+    查看或切换性能分析状态（仅管理员）
+    
+    GET返回各调用的耗时统计和最慢的调用（查询参数top，默认20）；
+    POST参数enabled开启或关闭性能分析，sampling同时开启调用栈采样
+    
+    Returns:
+        JSON响应
+    """
+    _require_admin()
+    if request.method == "POST":
+        options = request.get_json(silent=True) or request.form
+        if str(options.get("enabled", "")).lower() in ("1", "true"):
+            enable_profiling(sampling=str(options.get("sampling", "")).lower() in ("1", "true"))
+        else:
+            disable_profiling()
+    top = request.args.get("top", 20, type=int)
+    return jsonify(get_profile_report(top))
+
+
+def admin_flamegraph():
+    """
+    导出采样到的调用栈（折叠格式，可直接用于flamegraph.pl或speedscope，仅管理员）
+    
+    Returns:
+        文本响应
+    """
+    _require_admin()
+    return Response(get_folded_stacks(), mimetype='text/plain')
+
+
 def create_app():
     """
     创建Dash应用实例
@@ -80,18 +230,37 @@ def create_app():
     # 注册图片服务路由
     server.add_url_rule('/assets/<path:filename>', 'serve_image', serve_image)
     
+    # 注册JSON API路由
+    server.add_url_rule('/api/images', 'api_images', api_images)
+    server.add_url_rule('/api/images/<md5>', 'api_image', api_image)
+    server.add_url_rule('/api/tags', 'api_tags', api_tags)
+    
+    # 注册性能分析管理路由
+    server.add_url_rule('/admin/profiling', 'admin_profiling', admin_profiling, methods=['GET', 'POST'])
+    server.add_url_rule('/admin/profiling/flamegraph', 'admin_flamegraph', admin_flamegraph)
+    
     # 初始化Dash应用
     app = dash.Dash(__name__, 
                    server=server,
                    external_stylesheets=[dbc.themes.BOOTSTRAP])
     app.title = "图片标签管理器"
     
+    # 预计算缓存中所有图片的URL，画廊渲染时无需路径运算（快照可用时只读取路径和MD5路径列）
+    snapshot = open_snapshot()
+    precompute_image_urls(snapshot if snapshot is not None else get_cache_data(), load_image_index())
+    
+    # 启动缓存回收后台任务（CACHE_GC_INTERVAL为0时不启动）
+    start_gc_scheduler()
+    
     # 设置应用布局
     app.layout = create_layout()
     
     # 注册回调函数
     register_callbacks(app)
     
+    # 为回调和路由添加耗时记录（性能分析关闭时不记录）
+    instrument_dash_app(app)
+    
     return app
 
 # 创建应用实例
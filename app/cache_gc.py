@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from config import (CACHE_FILE, INDEX_FILE, CACHE_GC_INTERVAL, CACHE_GC_BATCH_SIZE, CACHE_GC_WORKERS, CACHE_GC_GRACE,
+                    CACHE_GC_MAX_MISSING_RATIO, GC_STATE_FILE)
+from utils import (get_cache_data, save_cache_data, invalidate_image_url, write_json_atomic, IMAGE_ROOTS,
+                   CACHE_WRITE_LOCK)
+from cache_snapshot import open_snapshot
+from cache_stats import load_statistics, save_statistics, update_entry
+from image_index import load_image_index, save_image_index
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 防止多个回收任务同时运行
+_gc_lock = threading.Lock()
+
+# 跨批次复用的缓存视图，见_load_view
+_gc_view = None
+
+# 一批中缺失文件数达到此值且占比超过CACHE_GC_MAX_MISSING_RATIO时，本批不做标记和删除
+GC_MIN_SUSPICIOUS_MISSING = 10
+
+# 文件状态
+FILE_PRESENT = "present"
+FILE_MISSING = "missing"
+FILE_UNKNOWN = "unknown"
+
+
+def _directory_available(directory: str, checked: Dict[str, bool]) -> bool:
+    """
+    从文件所在目录向上找到第一个存在的目录，该目录为空（常见于未挂载的网络存储挂载点）
+    或不可访问时视为存储不可用，不能据此判断文件已被删除
+
+    Args:
+        directory (str): 文件所在目录
+        checked (Dict[str, bool]): 本批次已检查过的目录，避免重复列目录
+
+    Returns:
+        bool: 存储是否可用
+    """
+    while directory not in checked:
+        try:
+            with os.scandir(directory) as entries:
+                checked[directory] = any(True for _ in entries)
+        except FileNotFoundError:
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                # 盘符或根目录不存在
+                checked[directory] = False
+            else:
+                directory = parent
+        except OSError:
+            checked[directory] = False
+    return checked[directory]
+
+
+def _stat_path(image_path: str, unavailable_roots: Set[str], checked: Dict[str, bool]) -> str:
+    """
+    检查文件是否存在，文件所在的存储不可访问（如未挂载）时返回未知状态
+
+    Args:
+        image_path (str): 图片路径
+        unavailable_roots (Set[str]): 本批次不可用的图片目录
+        checked (Dict[str, bool]): 本批次已检查过的目录
+
+    Returns:
+        str: 文件状态
+    """
+    try:
+        os.stat(image_path)
+        return FILE_PRESENT
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return FILE_UNKNOWN
+
+    # 整个图片目录不可访问时不能判断文件已被删除
+    abs_path = os.path.abspath(image_path)
+    for image_root in unavailable_roots:
+        if abs_path.startswith(image_root + os.sep):
+            return FILE_UNKNOWN
+    if not _directory_available(os.path.dirname(abs_path), checked):
+        return FILE_UNKNOWN
+    return FILE_MISSING
+
+
+def _check_roots(mounts: List[str]) -> Tuple[Set[str], List[str]]:
+    """
+    检查配置的图片目录是否可用：目录不存在，或之前是挂载点而现在不是（存储已卸载）时不可用
+
+    Args:
+        mounts (List[str]): 之前检查时是挂载点的图片目录
+
+    Returns:
+        Tuple[Set[str], List[str]]: 不可用的图片目录和更新后的挂载点列表
+    """
+    unavailable = set()
+    current_mounts = []
+    for image_root in IMAGE_ROOTS:
+        if os.path.ismount(image_root):
+            current_mounts.append(image_root)
+        elif not os.path.isdir(image_root) or image_root in mounts:
+            unavailable.add(image_root)
+            if image_root in mounts:
+                # 保留记录，存储重新挂载前一直视为不可用
+                current_mounts.append(image_root)
+                logger.warning(f"图片目录原为挂载点，当前未挂载，跳过其中的文件: {image_root}")
+    return unavailable, current_mounts
+
+
+def _load_state() -> Dict:
+    try:
+        with open(GC_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(cursor: Optional[str], mounts: List[str]) -> None:
+    write_json_atomic(GC_STATE_FILE, {"cursor": cursor, "mounts": mounts, "updated_at": time.time()},
+                      ensure_ascii=False)
+
+
+def _file_signature(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+def _load_view() -> Dict:
+    """
+    获取缓存和索引的只读视图及按路径排序的条目列表，缓存文件和索引文件未变化时跨批次复用
+
+    Returns:
+        Dict: signature（文件签名）、cache（快照或缓存字典）、index（元数据索引）、paths（排序后的路径）
+    """
+    global _gc_view
+    signature = (_file_signature(CACHE_FILE), _file_signature(INDEX_FILE))
+    if _gc_view is None or _gc_view["signature"] != signature:
+        # 快照可用时按需解码条目，不加载完整缓存
+        cache = open_snapshot()
+        if cache is None:
+            cache = get_cache_data()
+        image_index = load_image_index()
+        _gc_view = {
+            "signature": signature,
+            "cache": cache,
+            "index": image_index,
+            "paths": sorted(set(cache) | set(image_index))
+        }
+    return _gc_view
+
+
+def _check_batch(view: Dict, cursor: Optional[str], batch_size: int, now: float,
+                 unavailable_roots: Set[str]) -> Dict:
+    """
+    检查从游标处开始的一批条目对应的文件，只读取视图，不修改缓存
+
+    Returns:
+        Dict: batch（本批路径）、wrapped（是否完成一轮）以及需要标记、删除、恢复的路径
+    """
+    all_paths = view["paths"]
+    start = bisect.bisect_right(all_paths, cursor) if cursor else 0
+    batch = all_paths[start:start + batch_size]
+
+    # 并行stat，网络文件系统上单次stat延迟较高
+    checked: Dict[str, bool] = {}
+    with ThreadPoolExecutor(max_workers=CACHE_GC_WORKERS) as executor:
+        states = dict(zip(batch, executor.map(lambda path: _stat_path(path, unavailable_roots, checked), batch)))
+
+    # 一批中大量文件同时缺失时，更可能是存储未挂载或路径变化，本批只恢复不标记和删除
+    missing_count = sum(1 for state in states.values() if state == FILE_MISSING)
+    if missing_count >= GC_MIN_SUSPICIOUS_MISSING and missing_count > len(batch) * CACHE_GC_MAX_MISSING_RATIO:
+        logger.warning(f"缓存回收 - 本批 {len(batch)} 个条目中 {missing_count} 个文件缺失，"
+                       f"超过CACHE_GC_MAX_MISSING_RATIO，跳过标记和删除")
+        states = {path: state for path, state in states.items() if state != FILE_MISSING}
+
+    cache = view["cache"]
+    result = {
+        "batch": batch,
+        "wrapped": start + batch_size >= len(all_paths),
+        "tombstoned": [],
+        "evicted": [],
+        "restored": []
+    }
+    for image_path, state in states.items():
+        if state == FILE_UNKNOWN:
+            continue
+        data = cache.get(image_path)
+        if state == FILE_PRESENT:
+            if data and "missing_since" in data:
+                result["restored"].append(image_path)
+        elif data is None or now - data.get("missing_since", now) >= CACHE_GC_GRACE:
+            result["evicted"].append(image_path)
+        elif "missing_since" not in data:
+            result["tombstoned"].append(image_path)
+    return result
+
+
+def _apply_changes(tombstoned: List[str], evicted: List[str], restored: List[str], now: float) -> None:
+    """
+    将检查结果写入缓存、统计聚合和元数据索引，需在持有CACHE_WRITE_LOCK时调用
+    """
+    global _gc_view
+    if not (tombstoned or evicted or restored):
+        return
+
+    view = _gc_view
+    signature = (_file_signature(CACHE_FILE), _file_signature(INDEX_FILE))
+    # 检查期间其他进程写入过缓存时重新读取，保留对方的修改；否则直接使用已加载的缓存字典
+    if view["signature"] == signature and isinstance(view["cache"], dict):
+        cache = view["cache"]
+    else:
+        cache = get_cache_data()
+    stats = load_statistics()
+
+    # 已标记为缺失的条目不计入统计聚合，标记、恢复和删除时相应地扣除或累加
+    for image_path in tombstoned:
+        data = cache.get(image_path)
+        if data is not None and "missing_since" not in data:
+            cache[image_path] = dict(data, missing_since=now)
+            update_entry(stats, image_path, data, cache[image_path])
+    for image_path in restored:
+        data = cache.get(image_path)
+        if data is not None and "missing_since" in data:
+            cache[image_path] = {key: value for key, value in data.items() if key != "missing_since"}
+            update_entry(stats, image_path, data, cache[image_path])
+    for image_path in evicted:
+        if image_path in cache:
+            update_entry(stats, image_path, cache.pop(image_path), None)
+        invalidate_image_url(image_path)
+    save_cache_data(cache)
+    save_statistics(stats)
+
+    image_index = load_image_index()
+    evicted_index = [image_path for image_path in evicted if image_path in image_index]
+    if evicted_index:
+        image_index = dict(image_index)
+        for image_path in evicted_index:
+            del image_index[image_path]
+        save_image_index(image_index)
+
+    # 视图随本次写入更新，下一批次无需重新加载和排序
+    removed = set(evicted)
+    _gc_view = {
+        "signature": (_file_signature(CACHE_FILE), _file_signature(INDEX_FILE)),
+        "cache": cache,
+        "index": image_index,
+        "paths": [image_path for image_path in view["paths"] if image_path not in removed]
+        if removed else view["paths"]
+    }
+
+
+def _summary(result: Dict) -> Dict:
+    return {
+        "checked_count": len(result["batch"]),
+        "tombstoned_count": len(result["tombstoned"]),
+        "evicted_count": len(result["evicted"]),
+        "restored_count": len(result["restored"]),
+        "wrapped": result["wrapped"]
+    }
+
+
+def reconcile_cache(batch_size: int = CACHE_GC_BATCH_SIZE) -> Dict:
+    """
+    检查一批缓存条目和索引条目对应的文件是否仍然存在，从上次结束的位置继续
+
+    缺失的文件先标记missing_since，超过CACHE_GC_GRACE秒仍缺失时从缓存、统计聚合和
+    元数据索引中删除；文件重新出现时清除标记。写入采用替换文件的方式，读取方不会被阻塞。
+    扫描进行中（持有CACHE_WRITE_LOCK）时跳过本次回收。
+
+    Args:
+        batch_size (int): 本次检查的条目数
+
+    Returns:
+        Dict: 回收结果，包括检查数、标记数、删除数、恢复数、是否完成一轮和是否跳过
+    """
+    with _gc_lock:
+        if not CACHE_WRITE_LOCK.acquire(blocking=False):
+            logger.info("扫描进行中，跳过本次缓存回收")
+            return dict(_summary({"batch": [], "wrapped": False, "tombstoned": [], "evicted": [], "restored": []}),
+                        skipped=True)
+        try:
+            now = time.time()
+            state = _load_state()
+            unavailable_roots, mounts = _check_roots(state.get("mounts", []))
+            result = _check_batch(_load_view(), state.get("cursor"), batch_size, now, unavailable_roots)
+            _apply_changes(result["tombstoned"], result["evicted"], result["restored"], now)
+            batch = result["batch"]
+            _save_state(None if result["wrapped"] else (batch[-1] if batch else None), mounts)
+        finally:
+            CACHE_WRITE_LOCK.release()
+
+    summary = _summary(result)
+    if summary["tombstoned_count"] or summary["evicted_count"] or summary["restored_count"]:
+        logger.info(f"缓存回收 - 检查: {summary['checked_count']}, 标记缺失: {summary['tombstoned_count']}, "
+                    f"删除: {summary['evicted_count']}, 恢复: {summary['restored_count']}")
+    return dict(summary, skipped=False)
+
+
+def reconcile_all() -> Dict:
+    """
+    分批检查完整一轮，所有批次的结果在最后一次写入（等待正在进行的扫描结束）
+
+    Returns:
+        Dict: 累计回收结果
+    """
+    total = {"checked_count": 0, "tombstoned_count": 0, "evicted_count": 0, "restored_count": 0}
+    changes = {"tombstoned": [], "evicted": [], "restored": []}
+    with _gc_lock, CACHE_WRITE_LOCK:
+        now = time.time()
+        view = _load_view()
+        unavailable_roots, mounts = _check_roots(_load_state().get("mounts", []))
+        cursor = None
+        while True:
+            result = _check_batch(view, cursor, CACHE_GC_BATCH_SIZE, now, unavailable_roots)
+            for key in changes:
+                changes[key].extend(result[key])
+            for key, value in _summary(result).items():
+                if key in total:
+                    total[key] += value
+            if result["wrapped"]:
+                break
+            cursor = result["batch"][-1]
+        _apply_changes(changes["tombstoned"], changes["evicted"], changes["restored"], now)
+        _save_state(None, mounts)
+    return total
+
+
+def start_gc_scheduler(interval: int = CACHE_GC_INTERVAL) -> Optional[threading.Thread]:
+    """
+    启动后台线程定期执行缓存回收，每次检查一批条目
+
+    Args:
+        interval (int): 执行间隔（秒），0表示不启动
+
+    Returns:
+        Optional[threading.Thread]: 后台线程，未启动时返回None
+    """
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                reconcile_cache()
+            except Exception as e:
+                logger.error(f"缓存回收异常: {str(e)}")
+
+    thread = threading.Thread(target=run, name="cache-gc", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    print(reconcile_all())
@@ -0,0 +1,179 @@
+import os
+import copy
+import bisect
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Optional
+from config import CACHE_FILE
+from utils import get_cache_data, generate_md5_path, extract_image_tags
+from cache_snapshot import open_snapshot
+from profiler import profiled
+
+
+class CacheIndex:
+    """
+    缓存数据的内存索引，按MD5和标签组织，缓存文件变化时自动重建
+
+    每次重建后generation加一，etag由缓存文件的修改时间和大小生成，
+    多个进程读取同一缓存文件时得到相同的etag。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self.generation = 0
+        self.etag = ""
+        # 缓存数据来源：二进制快照（按需解码条目）或缓存字典
+        self._source = {}
+        # MD5 -> 图片路径
+        self.by_md5: Dict[str, str] = {}
+        # MD5路径（带扩展名） -> 图片路径
+        self.by_md5_path: Dict[str, str] = {}
+        # 按MD5排序的列表，用于游标分页
+        self.md5_order: List[str] = []
+        # 标签 -> 按MD5排序的列表
+        self.tag_to_md5: Dict[str, List[str]] = {}
+
+    @profiled("stage:cache_index_refresh")
+    def refresh(self) -> "CacheIndex":
+        """
+        缓存文件的修改时间或大小变化时重建索引
+
+        Returns:
+            CacheIndex: 索引自身
+        """
+        try:
+            stat = os.stat(CACHE_FILE)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+
+        if signature == self._signature and self.generation:
+            return self
+
+        with self._lock:
+            if signature == self._signature and self.generation:
+                return self
+            # 快照可用时只读取路径、MD5和标签列，不解码条目
+            snapshot = open_snapshot() if signature else None
+            if snapshot is not None:
+                missing = snapshot.missing_flags()
+                self._build((row for row, is_missing in zip(snapshot.rows(), missing) if not is_missing), snapshot)
+            else:
+                cache_data = get_cache_data() if signature else {}
+                self._build(((image_path, data.get("md5_path"), extract_image_tags(data.get("labels", "")))
+                             for image_path, data in cache_data.items()
+                             # 跳过已标记为文件缺失的条目
+                             if "missing_since" not in data), cache_data)
+            self._signature = signature
+            self.generation += 1
+            self.etag = f"{signature[0]:x}-{signature[1]:x}" if signature else "empty"
+        return self
+
+    def pinned(self) -> "CacheIndex":
+        """
+        获取当前索引的固定副本，与原索引共享数据（不复制），之后的重建不会影响副本，
+        用于流式响应等在返回之后才读取索引的场景
+
+        Returns:
+            CacheIndex: 索引副本
+        """
+        # 重建在持有锁时进行，持有锁复制可保证各字段来自同一次构建
+        with self._lock:
+            return copy.copy(self)
+
+    def _build(self, rows: Iterable[tuple], source: Mapping) -> None:
+        """
+        根据(图片路径, MD5路径, 标签列表)构建索引，构建完成后一次性替换，读取方不会看到构建了一半的索引
+        """
+        by_md5 = {}
+        by_md5_path = {}
+        tag_to_md5 = {}
+        for image_path, md5_path, tags in rows:
+            md5_path = md5_path or generate_md5_path(image_path)
+            md5 = os.path.splitext(md5_path)[0]
+            by_md5[md5] = image_path
+            by_md5_path[md5_path] = image_path
+            for tag in set(tags):
+                tag_to_md5.setdefault(tag, []).append(md5)
+
+        for md5_list in tag_to_md5.values():
+            md5_list.sort()
+
+        self._source = source
+        self.by_md5 = by_md5
+        self.by_md5_path = by_md5_path
+        self.md5_order = sorted(by_md5)
+        self.tag_to_md5 = tag_to_md5
+
+    def get(self, md5: str) -> Optional[tuple]:
+        """
+        根据MD5获取图片路径和缓存条目
+
+        Args:
+            md5 (str): 图片MD5（不带扩展名）
+
+        Returns:
+            Optional[tuple]: (图片路径, 缓存条目)，不存在时返回None
+        """
+        image_path = self.by_md5.get(md5)
+        if image_path is None:
+            return None
+        try:
+            return image_path, self._source[image_path]
+        except (KeyError, ValueError):
+            # 未找到、索引正在重建，或快照映射已在写入新快照前关闭（Windows）
+            return None
+
+    def get_by_md5_path(self, md5_path: str) -> Optional[str]:
+        """
+        根据MD5路径查找图片真实路径
+
+        Args:
+            md5_path (str): MD5路径（带扩展名）
+
+        Returns:
+            Optional[str]: 图片路径，不存在时返回None
+        """
+        return self.by_md5_path.get(md5_path)
+
+    def page(self, tag: Optional[str] = None, cursor: Optional[str] = None, limit: int = 100) -> tuple:
+        """
+        按MD5顺序分页获取图片
+
+        Args:
+            tag (str, optional): 只返回包含该标签的图片
+            cursor (str, optional): 上一页最后一张图片的MD5
+            limit (int): 每页数量
+
+        Returns:
+            tuple: (本页的MD5列表, 下一页游标，没有下一页时为None)
+        """
+        order = self.tag_to_md5.get(tag, []) if tag else self.md5_order
+        start = bisect.bisect_right(order, cursor) if cursor else 0
+        md5_list = order[start:start + limit]
+        next_cursor = md5_list[-1] if start + limit < len(order) else None
+        return md5_list, next_cursor
+
+    def tag_counts(self) -> Dict[str, int]:
+        """
+        获取每个标签的图片数量
+
+        Returns:
+            Dict[str, int]: 标签到图片数量的映射
+        """
+        return {tag: len(md5_list) for tag, md5_list in sorted(self.tag_to_md5.items())}
+
+
+# 进程内共享的索引实例
+_cache_index = CacheIndex()
+
+
+def get_cache_index() -> CacheIndex:
+    """
+    获取最新的缓存索引
+
+    Returns:
+        CacheIndex: 缓存索引
+    """
+    return _cache_index.refresh()
@@ -0,0 +1,353 @@
+"""
+缓存二进制快照：与cache.json内容相同的紧凑格式，可通过mmap打开并按需解码条目。
+
+文件格式（小端序）:
+    头部      MAGIC, 源cache.json的修改时间(ns)和大小, 条目数, 标签数, 各分段的(偏移, 长度)
+    paths     字符串表: (条目数+1)个uint64偏移 + UTF-8数据，条目保持cache.json中的顺序
+    order     按路径UTF-8字节排序的uint32行号，用于二分查找
+    md5s      字符串表: MD5路径
+    tags      字符串表: 去重后的标签
+    tag_ids   (条目数+1)个uint64偏移 + uint32标签编号
+    tokens    4列int64: 输入、输出、图片、总token数
+    flags     每个条目1字节，FLAG_MISSING表示文件已标记为缺失
+    entries   JSON数组表: (条目数+1)个uint64偏移 + 每个条目的完整JSON组成的JSON数组，
+              可以只解码单个条目，也可以一次解码全部条目
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+import logging
+import tempfile
+from array import array
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterator, List, Optional
+from config import CACHE_FILE, SNAPSHOT_FILE
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ITMSNAP1"
+SECTIONS = ("paths", "order", "md5s", "tags", "tag_ids", "tokens", "flags", "entries")
+HEADER = struct.Struct("<8sqQII")
+SECTION = struct.Struct("<QQ")
+OFFSET = struct.Struct("<Q")
+ROW_ID = struct.Struct("<I")
+TAG_ID = struct.Struct("<I")
+TOKEN = struct.Struct("<q")
+TOKEN_COLUMNS = ("input_tokens", "output_tokens", "image_tokens", "total_tokens")
+
+# 条目标志位
+FLAG_MISSING = 1
+
+# 当前打开的快照: (快照文件修改时间, 快照)
+_snapshot_cache = None
+
+# Windows下被映射的文件无法替换，写入新快照前需先关闭本进程中的映射
+MAPPED_FILES_LOCKED = os.name == "nt"
+
+
+def _to_bytes(values: array) -> bytes:
+    """
+    将数组转换为小端序字节
+    """
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _string_table(strings: List[str]) -> bytes:
+    """
+    构建字符串表: 偏移数组 + UTF-8数据
+    """
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = array('Q', [0])
+    for item in encoded:
+        offsets.append(offsets[-1] + len(item))
+    return _to_bytes(offsets) + b"".join(encoded)
+
+
+def _json_table(documents: List[str]) -> bytes:
+    """
+    构建JSON数组表: 偏移数组 + JSON数组，第i个元素位于[offsets[i], offsets[i+1] - 1)
+    """
+    encoded = [document.encode('utf-8') for document in documents]
+    offsets = array('Q', [1])
+    for item in encoded:
+        offsets.append(offsets[-1] + len(item) + 1)
+    return _to_bytes(offsets) + b"[" + b",".join(encoded) + b"]"
+
+
+def write_snapshot(cache_data: Dict, tag_extractor: Callable[[object], List[str]],
+                   source: os.stat_result) -> None:
+    """
+    根据缓存数据写入二进制快照（先写临时文件再替换），需在cache.json写入完成后调用
+
+    Args:
+        cache_data (Dict): 缓存数据
+        tag_extractor (Callable): 从标签内容中提取标签列表的函数
+        source (os.stat_result): 本次写入的cache.json在替换前的状态（对临时文件fstat得到），
+            不在替换后重新stat，避免其他写入方在此期间替换cache.json导致快照记录错误的来源
+    """
+    paths = list(cache_data)
+    order = array('I', sorted(range(len(paths)), key=lambda i: paths[i].encode('utf-8')))
+
+    tag_ids: Dict[str, int] = {}
+    tag_offsets = array('Q', [0])
+    row_tags = array('I')
+    columns = {column: array('q') for column in TOKEN_COLUMNS}
+    flags = bytearray()
+    md5s = []
+    entries = []
+    for image_path in paths:
+        data = cache_data[image_path]
+        md5s.append(data.get("md5_path", ""))
+        entries.append(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+        for tag in tag_extractor(data.get("labels", "")):
+            row_tags.append(tag_ids.setdefault(tag, len(tag_ids)))
+        tag_offsets.append(len(row_tags))
+        token_usage = data.get("token_usage") or {}
+        for column in TOKEN_COLUMNS:
+            value = token_usage.get(column)
+            if value is None and column == "image_tokens":
+                value = (token_usage.get("input_tokens_details") or {}).get("image_tokens")
+            columns[column].append(value or 0)
+        flags.append(FLAG_MISSING if "missing_since" in data else 0)
+
+    sections = [
+        _string_table(paths),
+        _to_bytes(order),
+        _string_table(md5s),
+        _string_table(list(tag_ids)),
+        _to_bytes(tag_offsets) + _to_bytes(row_tags),
+        b"".join(_to_bytes(columns[column]) for column in TOKEN_COLUMNS),
+        bytes(flags),
+        _json_table(entries)
+    ]
+
+    header_size = HEADER.size + SECTION.size * len(SECTIONS)
+    table = []
+    offset = header_size
+    for section in sections:
+        table.append(SECTION.pack(offset, len(section)))
+        offset += len(section)
+
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(SNAPSHOT_FILE)),
+                                    prefix=f"{os.path.basename(SNAPSHOT_FILE)}.", suffix=".tmp")
+    with os.fdopen(fd, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, source.st_mtime_ns, source.st_size, len(paths), len(tag_ids)))
+        f.write(b"".join(table))
+        for section in sections:
+            f.write(section)
+    if MAPPED_FILES_LOCKED:
+        _release_snapshot()
+    try:
+        os.replace(tmp_file, SNAPSHOT_FILE)
+    except OSError as e:
+        # Windows下快照被其他进程映射时无法替换，读取方会因快照过期回退到JSON
+        logger.warning(f"快照替换失败: {str(e)}")
+        os.remove(tmp_file)
+
+
+def _release_snapshot() -> None:
+    """
+    关闭本进程中打开的快照映射，之后仍持有旧快照的读取方会得到ValueError
+    """
+    global _snapshot_cache
+    if _snapshot_cache is not None:
+        _snapshot_cache[1].close()
+        _snapshot_cache = None
+
+
+class CacheSnapshot(Mapping):
+    """
+    通过mmap打开的缓存快照，按路径查找条目时二分查找并只解码该条目
+    """
+
+    def __init__(self, path: str = SNAPSHOT_FILE):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.source_mtime_ns, self.source_size, self._count, self._tag_count = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"无效的快照文件: {path}")
+        self._sections = {
+            name: SECTION.unpack_from(self._mm, HEADER.size + SECTION.size * i)[0]
+            for i, name in enumerate(SECTIONS)
+        }
+        self._entries: Dict[int, Dict] = {}
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def is_fresh(self) -> bool:
+        """
+        快照是否与当前的cache.json一致
+
+        Returns:
+            bool: 是否一致
+        """
+        try:
+            source = os.stat(CACHE_FILE)
+        except FileNotFoundError:
+            return False
+        return (source.st_mtime_ns, source.st_size) == (self.source_mtime_ns, self.source_size)
+
+    def _string(self, section: str, count: int, i: int) -> bytes:
+        base = self._sections[section]
+        start, end = struct.unpack_from("<QQ", self._mm, base + OFFSET.size * i)
+        data = base + OFFSET.size * (count + 1)
+        return self._mm[data + start:data + end]
+
+    def _find(self, image_path: str) -> int:
+        key = image_path.encode('utf-8')
+        order = self._sections["order"]
+        # 在按路径排序的行号上二分查找
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._string("paths", self._count, ROW_ID.unpack_from(self._mm, order + ROW_ID.size * mid)[0]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count:
+            row = ROW_ID.unpack_from(self._mm, order + ROW_ID.size * lo)[0]
+            if self._string("paths", self._count, row) == key:
+                return row
+        raise KeyError(image_path)
+
+    def path(self, i: int) -> str:
+        return self._string("paths", self._count, i).decode('utf-8')
+
+    def md5_path(self, i: int) -> str:
+        return self._string("md5s", self._count, i).decode('utf-8')
+
+    def tags(self, i: int) -> List[str]:
+        base = self._sections["tag_ids"]
+        start, end = struct.unpack_from("<QQ", self._mm, base + OFFSET.size * i)
+        ids = base + OFFSET.size * (self._count + 1)
+        return [self._string("tags", self._tag_count, TAG_ID.unpack_from(self._mm, ids + TAG_ID.size * j)[0])
+                .decode('utf-8') for j in range(start, end)]
+
+    def tokens(self, i: int) -> Dict[str, int]:
+        base = self._sections["tokens"]
+        return {column: TOKEN.unpack_from(self._mm, base + TOKEN.size * (self._count * c + i))[0]
+                for c, column in enumerate(TOKEN_COLUMNS)}
+
+    def is_missing(self, i: int) -> bool:
+        return bool(self._mm[self._sections["flags"] + i] & FLAG_MISSING)
+
+    def entry(self, i: int) -> Dict:
+        if i not in self._entries:
+            base = self._sections["entries"]
+            start, end = struct.unpack_from("<QQ", self._mm, base + OFFSET.size * i)
+            data = base + OFFSET.size * (self._count + 1)
+            self._entries[i] = json.loads(self._mm[data + start:data + end - 1])
+        return self._entries[i]
+
+    def __getitem__(self, image_path: str) -> Dict:
+        return self.entry(self._find(image_path))
+
+    def __contains__(self, image_path) -> bool:
+        try:
+            self._find(image_path)
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._strings("paths", self._count))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _array(self, typecode: str, offset: int, count: int) -> array:
+        values = array(typecode)
+        values.frombytes(self._mm[offset:offset + values.itemsize * count])
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def _strings(self, section: str, count: int) -> List[str]:
+        base = self._sections[section]
+        offsets = self._array('Q', base, count + 1)
+        data = base + OFFSET.size * (count + 1)
+        blob = self._mm[data:data + offsets[-1]]
+        return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(count)]
+
+    def rows(self) -> Iterator[tuple]:
+        """
+        批量读取路径、MD5路径和标签列，不解码条目
+
+        Returns:
+            Iterator[tuple]: (图片路径, MD5路径, 标签列表)
+        """
+        tag_names = self._strings("tags", self._tag_count)
+        base = self._sections["tag_ids"]
+        tag_offsets = self._array('Q', base, self._count + 1)
+        tag_ids = self._array('I', base + OFFSET.size * (self._count + 1), tag_offsets[-1])
+        for i, (image_path, md5_path) in enumerate(zip(self._strings("paths", self._count),
+                                                       self._strings("md5s", self._count))):
+            yield image_path, md5_path, [tag_names[t] for t in tag_ids[tag_offsets[i]:tag_offsets[i + 1]]]
+
+    def md5_rows(self) -> Iterator[tuple]:
+        """
+        批量读取路径和MD5路径列，不解码条目和标签
+
+        Returns:
+            Iterator[tuple]: (图片路径, MD5路径)，没有MD5路径时为空字符串
+        """
+        return zip(self._strings("paths", self._count), self._strings("md5s", self._count))
+
+    def missing_flags(self) -> List[bool]:
+        """
+        批量读取文件缺失标志
+
+        Returns:
+            List[bool]: 每个条目是否已标记为缺失
+        """
+        flags = self._sections["flags"]
+        return [bool(flag & FLAG_MISSING) for flag in self._mm[flags:flags + self._count]]
+
+    def to_dict(self) -> Dict:
+        """
+        解码全部条目为普通字典
+
+        Returns:
+            Dict: 缓存数据
+        """
+        # 没有条目时偏移数组只有起始偏移1，不能据此截取JSON数组
+        if not self._count:
+            return {}
+        base = self._sections["entries"]
+        data = base + OFFSET.size * (self._count + 1)
+        end = OFFSET.unpack_from(self._mm, base + OFFSET.size * self._count)[0]
+        # 条目以JSON数组存储，一次解码全部条目
+        entries = json.loads(self._mm[data:data + end])
+        return dict(zip(self._strings("paths", self._count), entries))
+
+
+def open_snapshot() -> Optional[CacheSnapshot]:
+    """
+    打开与cache.json一致的快照，快照不存在或已过期时返回None
+
+    Returns:
+        Optional[CacheSnapshot]: 快照
+    """
+    global _snapshot_cache
+    try:
+        mtime = os.stat(SNAPSHOT_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    if _snapshot_cache is None or _snapshot_cache[0] != mtime:
+        try:
+            _snapshot_cache = (mtime, CacheSnapshot(SNAPSHOT_FILE))
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"快照读取失败: {str(e)}")
+            return None
+
+    snapshot = _snapshot_cache[1]
+    return snapshot if snapshot.is_fresh() else None
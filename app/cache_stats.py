@@ -0,0 +1,276 @@
+import os
+import copy
+import json
+import time
+from typing import Dict, Optional
+from config import STATS_FILE, INPUT_TOKEN_PRICE, OUTPUT_TOKEN_PRICE
+from utils import get_cache_data, write_json_atomic, IMAGE_ROOTS
+
+# 图片处理状态
+STATUS_SUCCESS = "success"
+STATUS_FAILED = "failed"
+STATUS_ERROR = "error"
+
+# 统计数据格式版本，版本不一致时根据缓存重新计算（版本2起不统计已标记为文件缺失的条目，
+# 版本3起按图片根目录而不是末级目录汇总）
+STATS_VERSION = 3
+
+# 内存中的统计数据缓存: (文件修改时间, 统计数据)
+_stats_cache = None
+
+
+def get_entry_status(data: Dict) -> str:
+    """
+    获取缓存条目的处理状态，兼容没有status字段的旧缓存
+
+    Args:
+        data (Dict): 缓存条目
+
+    Returns:
+        str: 处理状态
+    """
+    status = data.get("status")
+    if status:
+        return status
+    labels = str(data.get("labels", ""))
+    if labels.startswith("处理失败"):
+        return STATUS_FAILED
+    if labels.startswith("处理异常"):
+        return STATUS_ERROR
+    return STATUS_SUCCESS
+
+
+def get_token_counts(data: Dict) -> Dict[str, int]:
+    """
+    从缓存条目中提取输入、输出、图片和总token数
+
+    Args:
+        data (Dict): 缓存条目
+
+    Returns:
+        Dict[str, int]: token分项统计
+    """
+    token_usage = data.get("token_usage") or {}
+    image_tokens = token_usage.get("image_tokens")
+    if image_tokens is None:
+        image_tokens = (token_usage.get("input_tokens_details") or {}).get("image_tokens", 0)
+    return {
+        "input_tokens": token_usage.get("input_tokens", 0) or 0,
+        "output_tokens": token_usage.get("output_tokens", 0) or 0,
+        "image_tokens": image_tokens or 0,
+        "total_tokens": token_usage.get("total_tokens", 0) or 0
+    }
+
+
+def get_stats_directory(image_path: str) -> str:
+    """
+    获取图片在按目录统计中所属的目录：位于配置的图片目录下时使用该图片目录，
+    避免照片库的每个末级文件夹各占一行；不在配置目录下时使用上一级目录
+
+    Args:
+        image_path (str): 图片路径
+
+    Returns:
+        str: 统计目录
+    """
+    abs_path = os.path.abspath(image_path)
+    roots = [root for root in IMAGE_ROOTS if abs_path.startswith(os.path.join(root, ""))]
+    if roots:
+        return max(roots, key=len)
+    return os.path.dirname(image_path)
+
+
+def empty_statistics() -> Dict:
+    """
+    创建空的统计数据
+
+    Returns:
+        Dict: 统计数据
+    """
+    return {
+        "version": STATS_VERSION,
+        "roots": IMAGE_ROOTS,
+        "total_images": 0,
+        "processed_images": 0,
+        "tokens": {"input_tokens": 0, "output_tokens": 0, "image_tokens": 0, "total_tokens": 0},
+        "status_counts": {},
+        "directories": {},
+        "scan": {}
+    }
+
+
+def apply_entry(stats: Dict, image_path: str, data: Dict, sign: int = 1) -> None:
+    """
+    将单个缓存条目累加到统计数据中（sign为-1时表示扣除），已标记为文件缺失的条目不计入统计
+
+    Args:
+        stats (Dict): 统计数据
+        image_path (str): 图片路径
+        data (Dict): 缓存条目
+        sign (int): 1表示累加，-1表示扣除
+    """
+    if "missing_since" in data:
+        return
+    processed = 1 if data.get("labels") else 0
+    tokens = get_token_counts(data)
+    status = get_entry_status(data)
+
+    stats["total_images"] += sign
+    stats["processed_images"] += sign * processed
+    for key, value in tokens.items():
+        stats["tokens"][key] += sign * value
+
+    status_counts = stats["status_counts"]
+    status_counts[status] = status_counts.get(status, 0) + sign
+    if status_counts[status] <= 0:
+        del status_counts[status]
+
+    directory = get_stats_directory(image_path)
+    dir_stats = stats["directories"].setdefault(
+        directory, {"images": 0, "processed_images": 0, "total_tokens": 0})
+    dir_stats["images"] += sign
+    dir_stats["processed_images"] += sign * processed
+    dir_stats["total_tokens"] += sign * tokens["total_tokens"]
+    if dir_stats["images"] <= 0:
+        del stats["directories"][directory]
+
+
+def update_entry(stats: Dict, image_path: str, old_data: Optional[Dict], new_data: Optional[Dict]) -> None:
+    """
+    缓存条目被写入或删除时，增量更新统计数据
+
+    Args:
+        stats (Dict): 统计数据
+        image_path (str): 图片路径
+        old_data (Dict, optional): 原有缓存条目，不存在时为None
+        new_data (Dict, optional): 新缓存条目，删除时为None
+    """
+    if old_data is not None:
+        apply_entry(stats, image_path, old_data, sign=-1)
+    if new_data is not None:
+        apply_entry(stats, image_path, new_data, sign=1)
+
+
+def rebuild_statistics(cache_data: Dict) -> Dict:
+    """
+    根据完整缓存重新计算统计数据（统计文件缺失、格式版本变化或全量扫描时使用）
+
+    Args:
+        cache_data (Dict): 缓存数据
+
+    Returns:
+        Dict: 统计数据
+    """
+    stats = empty_statistics()
+    for image_path, data in cache_data.items():
+        apply_entry(stats, image_path, data)
+    return stats
+
+
+def save_statistics(stats: Dict) -> None:
+    """
+    保存统计数据到统计文件
+
+    Args:
+        stats (Dict): 统计数据
+    """
+    global _stats_cache
+    stat = write_json_atomic(STATS_FILE, stats, ensure_ascii=False)
+    # 保存副本，调用方之后修改stats不会影响内存中的缓存
+    _stats_cache = (stat.st_mtime_ns, copy.deepcopy(stats))
+
+
+def load_statistics() -> Dict:
+    """
+    加载统计数据，文件未变化时使用内存中的数据
+
+    Returns:
+        Dict: 统计数据的副本，调用方可以直接修改
+    """
+    global _stats_cache
+    if os.path.exists(STATS_FILE):
+        mtime = os.stat(STATS_FILE).st_mtime_ns
+        if _stats_cache is None or _stats_cache[0] != mtime:
+            with open(STATS_FILE, 'r', encoding='utf-8') as f:
+                _stats_cache = (mtime, json.load(f))
+        # 图片目录配置变化时按目录统计的分组也随之变化，需要重新计算
+        if _stats_cache[1].get("version") == STATS_VERSION and _stats_cache[1].get("roots") == IMAGE_ROOTS:
+            return copy.deepcopy(_stats_cache[1])
+
+    # 统计文件不存在、格式版本或图片目录配置不一致时重新计算
+    stats = rebuild_statistics(get_cache_data())
+    save_statistics(stats)
+    return stats
+
+
+def start_scan(stats: Dict) -> None:
+    """
+    记录本次扫描开始，重置扫描计数
+
+    Args:
+        stats (Dict): 统计数据
+    """
+    now = time.time()
+    stats["scan"] = {
+        "started_at": now,
+        "updated_at": now,
+        "running": True,
+        "processed_count": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "total_tokens": 0
+    }
+
+
+def record_scan_result(stats: Dict, data: Dict) -> None:
+    """
+    将本次扫描处理的一张图片计入扫描计数
+
+    Args:
+        stats (Dict): 统计数据
+        data (Dict): 新的缓存条目
+    """
+    scan = stats["scan"]
+    tokens = get_token_counts(data)
+    scan["processed_count"] += 1
+    scan["input_tokens"] += tokens["input_tokens"]
+    scan["output_tokens"] += tokens["output_tokens"]
+    scan["total_tokens"] += tokens["total_tokens"]
+    scan["updated_at"] = time.time()
+
+
+def finish_scan(stats: Dict) -> None:
+    """
+    记录本次扫描结束
+
+    Args:
+        stats (Dict): 统计数据
+    """
+    stats["scan"]["running"] = False
+    stats["scan"]["updated_at"] = time.time()
+
+
+def get_scan_rates(stats: Dict) -> Dict:
+    """
+    计算本次扫描的吞吐量与成本速率
+
+    Args:
+        stats (Dict): 统计数据
+
+    Returns:
+        Dict: 包括每分钟图片数、每分钟token数、每张图片平均token数和每分钟成本
+    """
+    scan = stats.get("scan") or {}
+    if not scan:
+        return {}
+
+    minutes = max(scan["updated_at"] - scan["started_at"], 1) / 60
+    processed_count = scan["processed_count"]
+    cost = (scan["input_tokens"] * INPUT_TOKEN_PRICE + scan["output_tokens"] * OUTPUT_TOKEN_PRICE) / 1000
+    return {
+        "running": scan["running"],
+        "images_per_minute": processed_count / minutes,
+        "tokens_per_minute": scan["total_tokens"] / minutes,
+        "tokens_per_image": scan["total_tokens"] / processed_count if processed_count else 0,
+        "cost_per_minute": cost / minutes
+    }
@@ -6,8 +6,17 @@ from dash.dependencies import Input, Output, State, ALL
 import dash_bootstrap_components as dbc
 from dash import html, dcc
 from image_processor import process_images
-from utils import get_cache_data, calculate_total_tokens, extract_tags, simplify_labels, get_image_url
+from scan_scheduler import STOP_SCAN_BUDGET
+from utils import get_cache_data, extract_tags, simplify_labels, get_image_url
+from image_index import load_image_index, get_sort_time, get_resolution
+from cache_stats import load_statistics, get_scan_rates, STATUS_SUCCESS, STATUS_FAILED, STATUS_ERROR
 from config import IMAGE_DIRECTORIES
+from profiler import profile_section
+
+# 统计面板最多显示的目录数（按图片数排序），其余目录合并为一行
+DIRECTORY_STATS_LIMIT = 20
+# 画廊不分页，只把排在最前面、打开页面即可看到的卡片记为可见图片
+VISIBLE_IMAGES_LIMIT = 50
 
 
 def register_callbacks(app):
@@ -22,21 +31,52 @@ def register_callbacks(app):
     @app.callback(
         [Output("total-images", "children"),
          Output("processed-images", "children"),
-         Output("total-tokens", "children")],
+         Output("total-tokens", "children"),
+         Output("token-breakdown", "children"),
+         Output("status-counts", "children"),
+         Output("scan-rate", "children"),
+         Output("directory-stats", "children")],
         Input("cache-data", "data")
     )
     def update_statistics(cache_data):
-        if not cache_data:
-            cache_data = get_cache_data()
+        # 统计数据在写入缓存时增量维护，这里直接读取聚合结果
+        stats = load_statistics()
+        tokens = stats["tokens"]
+        
+        status_names = {STATUS_SUCCESS: "成功", STATUS_FAILED: "失败", STATUS_ERROR: "异常"}
+        status_text = " / ".join(
+            f"{status_names.get(status, status)}: {count}" for status, count in stats["status_counts"].items())
+        
+        rates = get_scan_rates(stats)
+        if rates:
+            scan_text = (f"{'扫描中' if rates['running'] else '上次扫描'}: "
+                         f"{rates['images_per_minute']:.1f} 张/分钟, "
+                         f"{rates['tokens_per_minute']:.0f} tokens/分钟, "
+                         f"{rates['tokens_per_image']:.0f} tokens/张")
+            if rates["cost_per_minute"]:
+                scan_text += f", ¥{rates['cost_per_minute']:.4f}/分钟"
+        else:
+            scan_text = "暂无扫描记录"
         
-        total_images = len(cache_data)
-        processed_images = len([v for v in cache_data.values() if v.get("labels")])
-        total_tokens = calculate_total_tokens(cache_data)
+        directories = sorted(stats["directories"].items(), key=lambda item: (-item[1]["images"], item[0]))
+        directory_items = [
+            html.Div(f"{directory}: {item['processed_images']}/{item['images']} 张, {item['total_tokens']} tokens")
+            for directory, item in directories[:DIRECTORY_STATS_LIMIT]
+        ]
+        if len(directories) > DIRECTORY_STATS_LIMIT:
+            rest = [item for _, item in directories[DIRECTORY_STATS_LIMIT:]]
+            directory_items.append(html.Div(
+                f"其余 {len(rest)} 个目录: {sum(item['processed_images'] for item in rest)}/"
+                f"{sum(item['images'] for item in rest)} 张, {sum(item['total_tokens'] for item in rest)} tokens"))
         
         return (
-            f"总图片数: {total_images}",
-            f"已处理图片数: {processed_images}",
-            f"总Token消耗: {total_tokens}"
+            f"总图片数: {stats['total_images']}",
+            f"已处理图片数: {stats['processed_images']}",
+            f"总Token消耗: {tokens['total_tokens']}",
+            f"输入: {tokens['input_tokens']} / 输出: {tokens['output_tokens']} / 图片: {tokens['image_tokens']}",
+            status_text,
+            scan_text,
+            directory_items
         )
 
     # 更新标签tabs
@@ -117,19 +157,25 @@ def register_callbacks(app):
 
     # 更新图片展示
     @app.callback(
-        Output("image-gallery", "children"),
+        [Output("image-gallery", "children"),
+         Output("visible-images", "data")],
         [Input("cache-data", "data"),
-         Input("selected-tag-storage", "data")],  # 监听标签按钮点击和存储的选中标签
+         Input("selected-tag-storage", "data"),  # 监听标签按钮点击和存储的选中标签
+         Input("gallery-sort", "value"),
+         Input("gallery-min-resolution", "value"),
+         Input("gallery-date-range", "start_date"),
+         Input("gallery-date-range", "end_date")],
         prevent_initial_call=False
     )
-    def update_gallery(cache_data, selected_tag):
+    def update_gallery(cache_data, selected_tag, sort_by, min_resolution, start_date, end_date):
         if not cache_data:
             cache_data = get_cache_data()
         
         # 构建标签到图片的映射
         tag_to_images = {}
         for image_path, data in cache_data.items():
-            if not data.get("labels"):
+            # 跳过没有标签或已标记为文件缺失的图片
+            if not data.get("labels") or "missing_since" in data:
                 continue
                 
             # 处理标签，提取标签列表
@@ -168,70 +214,94 @@ def register_callbacks(app):
                         images_to_show.append(image)
                         seen_images.add(image_path)
         
-        # 创建图片卡片
-        cards = []
-        for image_path, data in images_to_show:
-            # 处理标签显示
-            if isinstance(data["labels"], list):
-                display_labels = " ".join(data["labels"])
-            else:
-                display_labels = str(data["labels"])
-            
-            # 获取图片URL，使用MD5路径映射
-            image_url = get_image_url(image_path, cache_data)
-            
-            # 创建300*300的展示区块，优化图片展示效果
-            card = dbc.Card([
-                dbc.CardImg(src=image_url, 
-                           top=True, 
-                           style={
-                               "width": "300px", 
-                               "height": "300px", 
-                               "objectFit": "cover",
-                               "borderRadius": "8px 8px 0 0"
-                           }),
-                dbc.CardBody([
-                    html.H6(os.path.basename(image_path), 
-                           className="card-title", 
-                           style={
-                               "fontSize": "14px",
-                               "fontWeight": "500",
-                               "marginBottom": "5px",
-                               "overflow": "hidden",
-                               "textOverflow": "ellipsis",
-                               "whiteSpace": "nowrap"
-                           }),
-                    html.P(display_labels, 
-                          className="card-text",
-                          style={
-                              "fontSize": "12px",
-                              "color": "#666",
-                              "marginBottom": "5px",
-                              "height": "40px",
-                              "overflow": "hidden"
-                          }),
-                    html.Small(f"Tokens: {data.get('token_usage', {}).get('total_tokens', 0)}", 
-                              className="text-muted",
-                              style={"fontSize": "11px"})
-                ], style={"padding": "10px"})
-            ], className="mb-3", 
-            style={
-                "display": "inline-block", 
-                "margin": "5px",
-                "borderRadius": "8px",
-                "boxShadow": "0 2px 6px rgba(0,0,0,0.1)",
-                "border": "none",
-                "width": "300px",
-                "verticalAlign": "top"
-            })
-            
-            cards.append(card)
+        # 按元数据索引中的分辨率和拍摄时间过滤、排序
+        image_index = load_image_index()
+        if min_resolution:
+            images_to_show = [image for image in images_to_show
+                              if get_resolution(image_index.get(image[0], {})) >= min_resolution]
+        if start_date or end_date:
+            # 日期比较使用ISO字符串前缀，结束日期当天的图片包含在内
+            images_to_show = [image for image in images_to_show
+                              if image[0] in image_index
+                              and (not start_date or get_sort_time(image_index[image[0]]) >= start_date[:10])
+                              and (not end_date or get_sort_time(image_index[image[0]])[:10] <= end_date[:10])]
+        if sort_by in ("date_desc", "date_asc"):
+            # 没有元数据的图片排在最后
+            dated = [image for image in images_to_show if image[0] in image_index]
+            undated = [image for image in images_to_show if image[0] not in image_index]
+            dated.sort(key=lambda image: get_sort_time(image_index[image[0]]), reverse=(sort_by == "date_desc"))
+            images_to_show = dated + undated
+        elif sort_by == "resolution_desc":
+            images_to_show.sort(key=lambda image: get_resolution(image_index.get(image[0], {})), reverse=True)
+        
+        # 创建图片卡片（单独记录耗时，便于区分卡片构建和其他处理）
+        with profile_section("update_gallery:cards"):
+            cards = []
+            for image_path, data in images_to_show:
+                # 处理标签显示
+                if isinstance(data["labels"], list):
+                    display_labels = " ".join(data["labels"])
+                else:
+                    display_labels = str(data["labels"])
+                
+                # 获取图片URL，使用MD5路径映射
+                image_url = get_image_url(image_path, cache_data, image_index)
+                
+                # 创建300*300的展示区块，优化图片展示效果
+                card = dbc.Card([
+                    dbc.CardImg(src=image_url, 
+                               top=True, 
+                               style={
+                                   "width": "300px", 
+                                   "height": "300px", 
+                                   "objectFit": "cover",
+                                   "borderRadius": "8px 8px 0 0"
+                               }),
+                    dbc.CardBody([
+                        html.H6(os.path.basename(image_path), 
+                               className="card-title", 
+                               style={
+                                   "fontSize": "14px",
+                                   "fontWeight": "500",
+                                   "marginBottom": "5px",
+                                   "overflow": "hidden",
+                                   "textOverflow": "ellipsis",
+                                   "whiteSpace": "nowrap"
+                               }),
+                        html.P(display_labels, 
+                              className="card-text",
+                              style={
+                                  "fontSize": "12px",
+                                  "color": "#666",
+                                  "marginBottom": "5px",
+                                  "height": "40px",
+                                  "overflow": "hidden"
+                              }),
+                        html.Small(f"Tokens: {data.get('token_usage', {}).get('total_tokens', 0)}", 
+                                  className="text-muted",
+                                  style={"fontSize": "11px"})
+                    ], style={"padding": "10px"})
+                ], className="mb-3", 
+                style={
+                    "display": "inline-block", 
+                    "margin": "5px",
+                    "borderRadius": "8px",
+                    "boxShadow": "0 2px 6px rgba(0,0,0,0.1)",
+                    "border": "none",
+                    "width": "300px",
+                    "verticalAlign": "top"
+                })
+                
+                cards.append(card)
+        
+        # 记录首屏可见的图片，扫描时优先处理（画廊只展示已有缓存的图片，因此只影响全量扫描的重新处理顺序）
+        visible_images = [image_path for image_path, _ in images_to_show[:VISIBLE_IMAGES_LIMIT]]
         
         if not cards:
-            return html.P("没有找到匹配的图片。")
+            return html.P("没有找到匹配的图片。"), visible_images
         
         # 使用div容器包装所有卡片，实现5列平铺效果
-        return html.Div(cards, style={"display": "flex", "flexWrap": "wrap"})
+        return html.Div(cards, style={"display": "flex", "flexWrap": "wrap"}), visible_images
         
     # 处理扫描按钮点击
     @app.callback(
@@ -239,9 +309,14 @@ def register_callbacks(app):
          Output("cache-data", "data")],
         [Input("full-scan", "n_clicks"),
          Input("incremental-scan", "n_clicks")],
-        State("image-directory", "value")
+        [State("image-directory", "value"),
+         State("priority-directories", "value"),
+         State("scan-priority", "value"),
+         State("scan-token-budget", "value"),
+         State("visible-images", "data")]
     )
-    def handle_scan(full_clicks, incremental_clicks, directory_value):
+    def handle_scan(full_clicks, incremental_clicks, directory_value, priority_directories_value,
+                    priority, token_budget, visible_images):
         # 确定触发回调的按钮
         triggered_id = ctx.triggered_id
         
@@ -257,15 +332,32 @@ def register_callbacks(app):
         if not directories:
             directories = IMAGE_DIRECTORIES
         
+        priority_directories = []
+        if priority_directories_value:
+            priority_directories = [d.strip() for d in priority_directories_value.split(",") if d.strip()]
+        
+        # 调度参数：处理顺序和本次扫描的token预算（未填写时使用默认配置）
+        scan_options = {
+            "priority": priority,
+            "preferred_directories": priority_directories,
+            "visible_paths": visible_images,
+            "scan_token_budget": int(token_budget) if token_budget else None
+        }
+        
         # 执行扫描
         try:
             if triggered_id == "full-scan":
-                result = process_images(directories, incremental=False)
+                result = process_images(directories, incremental=False, **scan_options)
                 message = f"全量扫描完成，处理了 {result['processed_count']} 张图片，消耗 {result['total_tokens']} tokens"
             else:
-                result = process_images(directories, incremental=True)
+                result = process_images(directories, incremental=True, **scan_options)
                 message = f"增量扫描完成，处理了 {result['processed_count']} 张图片，消耗 {result['total_tokens']} tokens"
             
+            # 达到预算时提示剩余图片数，再次执行增量扫描即可继续
+            if result["stopped_reason"]:
+                budget_name = "本次扫描" if result["stopped_reason"] == STOP_SCAN_BUDGET else "今日"
+                message += f"（已达到{budget_name}token预算，剩余 {result['remaining_count']} 张图片，可通过增量扫描继续）"
+            
             # 返回成功消息和更新后的缓存数据
             return message, result["cache"]
         except Exception as e:
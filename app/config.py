@@ -2,7 +2,8 @@ import os
 
 # 图片目录配置 - 支持多个目录
 # 可以通过逗号分隔指定多个目录，或者使用环境变量 IMAGE_DIRECTORIES
-IMAGE_DIRECTORIES = os.getenv("IMAGE_DIRECTORIES", "")
+# 启动时解析为规范化后的目录列表，避免在各处重复解析
+IMAGE_DIRECTORIES = [os.path.normpath(d.strip()) for d in os.getenv("IMAGE_DIRECTORIES", "").split(",") if d.strip()]
 
 # 阿里云百炼配置
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY", "")
@@ -11,4 +12,54 @@ DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY", "")
 CACHE_FILE = os.getenv("CACHE_FILE", "./cache.json")
 
 # 支持的图片格式
-SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
\ No newline at end of file
+SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+# 统计聚合文件路径（与缓存文件放在一起）
+STATS_FILE = os.getenv("STATS_FILE", os.path.splitext(CACHE_FILE)[0] + ".stats.json")
+
+# Token单价（元/千tokens），用于计算扫描成本速率，未配置时不显示成本
+INPUT_TOKEN_PRICE = float(os.getenv("INPUT_TOKEN_PRICE", "0"))
+OUTPUT_TOKEN_PRICE = float(os.getenv("OUTPUT_TOKEN_PRICE", "0"))
+
+# 分片扫描配置：租约文件目录（需位于各工作节点共享的文件系统上）、租约过期时间（秒）、每个工作进程对应的分片数
+SHARD_DIR = os.getenv("SHARD_DIR", os.path.splitext(CACHE_FILE)[0] + ".shards")
+SHARD_LEASE_TTL = int(os.getenv("SHARD_LEASE_TTL", "300"))
+SHARD_BUCKETS_PER_WORKER = int(os.getenv("SHARD_BUCKETS_PER_WORKER", "8"))
+
+# 图片元数据索引文件路径（与缓存文件放在一起）
+INDEX_FILE = os.getenv("INDEX_FILE", os.path.splitext(CACHE_FILE)[0] + ".index.json")
+
+# 图片校验配置：文件大小上限（字节）和最小边长（像素），不满足的图片在调用模型前跳过
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+MIN_IMAGE_SIDE = int(os.getenv("MIN_IMAGE_SIDE", "10"))
+
+# 缓存回收配置：执行间隔（秒，0表示不自动执行）、每次检查的条目数、并行stat线程数、
+# 文件缺失多久后从缓存中删除（秒，在此之前只标记为缺失）、一批中缺失文件占比的上限
+# （超过时怀疑存储未挂载，本批不做标记和删除）
+CACHE_GC_INTERVAL = int(os.getenv("CACHE_GC_INTERVAL", "0"))
+CACHE_GC_BATCH_SIZE = int(os.getenv("CACHE_GC_BATCH_SIZE", "5000"))
+CACHE_GC_WORKERS = int(os.getenv("CACHE_GC_WORKERS", "16"))
+CACHE_GC_GRACE = int(os.getenv("CACHE_GC_GRACE", "86400"))
+CACHE_GC_MAX_MISSING_RATIO = float(os.getenv("CACHE_GC_MAX_MISSING_RATIO", "0.5"))
+GC_STATE_FILE = os.getenv("GC_STATE_FILE", os.path.splitext(CACHE_FILE)[0] + ".gc.json")
+
+# 缓存二进制快照文件路径（与缓存文件放在一起，用于快速冷启动加载）
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", os.path.splitext(CACHE_FILE)[0] + ".snapshot")
+
+# 扫描调度配置：优先级（逗号分隔，依次为 visible-画廊中可见的图片、directories-指定的优先目录、
+# mtime-最近修改的图片，walk表示按目录遍历顺序）、单次扫描和每日token预算（0表示不限制）、
+# 保存进度的间隔（秒），以及预算中断后待处理图片列表的保存位置（下次增量扫描从此继续）
+SCAN_PRIORITY = os.getenv("SCAN_PRIORITY", "visible,directories,mtime")
+SCAN_TOKEN_BUDGET = int(os.getenv("SCAN_TOKEN_BUDGET", "0"))
+DAILY_TOKEN_BUDGET = int(os.getenv("DAILY_TOKEN_BUDGET", "0"))
+BUDGET_FILE = os.getenv("BUDGET_FILE", os.path.splitext(CACHE_FILE)[0] + ".budget.json")
+SCAN_CHECKPOINT_INTERVAL = float(os.getenv("SCAN_CHECKPOINT_INTERVAL", "30"))
+SCAN_STATE_FILE = os.getenv("SCAN_STATE_FILE", os.path.splitext(CACHE_FILE)[0] + ".scan.json")
+
+# 性能分析配置：管理接口令牌（为空时不开放管理接口）、启动时是否开启分析、
+# 滚动窗口长度（秒）和保留的窗口数、采样间隔（秒）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_WINDOW_SECONDS = int(os.getenv("PROFILE_WINDOW_SECONDS", "60"))
+PROFILE_WINDOW_COUNT = int(os.getenv("PROFILE_WINDOW_COUNT", "10"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
@@ -0,0 +1,258 @@
+import os
+import json
+import struct
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+from config import INDEX_FILE, MAX_IMAGE_BYTES, MIN_IMAGE_SIDE
+from profiler import profiled
+from utils import write_json_atomic
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# EXIF标签: DateTimeOriginal位于Exif子IFD中，DateTime位于主IFD中
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+
+# 文件结束标记及其查找范围（从文件末尾向前）
+END_MARKERS = {"JPEG": b"\xff\xd9", "PNG": b"IEND", "GIF": b"\x00\x3b"}
+END_MARKER_SEARCH_BYTES = 1024 * 1024
+
+# 内存中的索引缓存: (文件修改时间, 索引数据)
+_index_cache = None
+
+
+def _read_capture_time(img: Image.Image) -> Optional[str]:
+    """
+    读取EXIF拍摄时间
+
+    Args:
+        img (Image.Image): 已打开的图片
+
+    Returns:
+        Optional[str]: ISO格式的拍摄时间，没有EXIF信息时返回None
+    """
+    try:
+        exif = img.getexif()
+        value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+        if value:
+            return datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S").isoformat()
+    except Exception:
+        pass
+    return None
+
+
+def _is_truncated(image_path: str, image_format: str, size: int) -> bool:
+    """
+    根据文件头中记录的文件长度判断图片是否被截断（WEBP、BMP），不解码图像数据
+
+    Args:
+        image_path (str): 图片路径
+        image_format (str): Pillow识别出的图片格式
+        size (int): 文件大小
+
+    Returns:
+        bool: 是否被截断，文件无法读取或文件头不完整时也视为截断
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            if image_format == "WEBP":
+                # RIFF头记录了文件长度（不含前8字节）
+                f.seek(4)
+                return struct.unpack("<I", f.read(4))[0] + 8 > size
+            if image_format == "BMP":
+                # BMP文件头记录了文件长度
+                f.seek(2)
+                return struct.unpack("<I", f.read(4))[0] > size
+    except (OSError, struct.error):
+        return True
+    return False
+
+
+def _has_end_marker(image_path: str, image_format: str, size: int) -> bool:
+    """
+    在文件末尾的END_MARKER_SEARCH_BYTES字节内从后向前查找结束标记（JPEG、PNG、GIF）。
+    结束标记之后可能还有合法的附加数据（相机填充、动态照片附带的视频等），因此不要求标记位于文件末尾
+
+    Args:
+        image_path (str): 图片路径
+        image_format (str): Pillow识别出的图片格式
+        size (int): 文件大小
+
+    Returns:
+        bool: 是否找到结束标记，其他格式始终返回True
+    """
+    marker = END_MARKERS.get(image_format)
+    if marker is None:
+        return True
+    try:
+        with open(image_path, 'rb') as f:
+            f.seek(max(size - END_MARKER_SEARCH_BYTES, 0))
+            return f.read().rfind(marker) >= 0
+    except OSError:
+        return False
+
+
+def read_image_metadata(image_path: str) -> Dict:
+    """
+    只读取图片文件头，获取格式、尺寸、帧数和拍摄时间，并校验图片是否可用
+
+    Args:
+        image_path (str): 图片路径
+
+    Returns:
+        Dict: 图片元数据，图片不可用时包含error字段
+    """
+    stat = os.stat(image_path)
+    metadata = {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+    if stat.st_size == 0:
+        metadata["error"] = "空文件"
+        return metadata
+    if stat.st_size > MAX_IMAGE_BYTES:
+        metadata["error"] = f"文件过大: {stat.st_size} 字节"
+        return metadata
+
+    try:
+        # Image.open只解析文件头，不解码像素数据
+        with Image.open(image_path) as img:
+            metadata["format"] = img.format
+            metadata["width"], metadata["height"] = img.size
+            metadata["frames"] = getattr(img, "n_frames", 1)
+            metadata["captured_at"] = _read_capture_time(img)
+    except Image.DecompressionBombError as e:
+        # 像素数超过Pillow的安全上限，DecompressionBombError不是OSError的子类
+        metadata["error"] = f"像素数过大: {str(e)}"
+        return metadata
+    except Exception as e:
+        # 包括UnidentifiedImageError、OSError以及各格式插件解析文件头时抛出的其他异常
+        metadata["error"] = f"无法识别的图片: {str(e)}"
+        return metadata
+
+    if min(metadata["width"], metadata["height"]) < MIN_IMAGE_SIDE:
+        metadata["error"] = f"尺寸过小: {metadata['width']}x{metadata['height']}"
+    elif _is_truncated(image_path, metadata["format"], stat.st_size):
+        metadata["error"] = "文件不完整"
+    elif not _has_end_marker(image_path, metadata["format"], stat.st_size):
+        # 附加数据超过查找范围时也找不到结束标记，只记录警告，图片仍然参与处理
+        metadata["warning"] = "未找到文件结束标记，文件可能不完整"
+        logger.warning(f"图片可能不完整: {image_path}")
+    return metadata
+
+
+def load_image_index() -> Dict:
+    """
+    加载图片元数据索引，文件未变化时直接返回内存中的数据
+
+    Returns:
+        Dict: 图片路径到元数据的映射
+    """
+    global _index_cache
+    if not os.path.exists(INDEX_FILE):
+        return {}
+
+    mtime = os.stat(INDEX_FILE).st_mtime_ns
+    if _index_cache is not None and _index_cache[0] == mtime:
+        return _index_cache[1]
+
+    with open(INDEX_FILE, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    _index_cache = (mtime, index)
+    return index
+
+
+def save_image_index(index: Dict) -> None:
+    """
+    保存图片元数据索引
+
+    Args:
+        index (Dict): 图片路径到元数据的映射
+    """
+    global _index_cache
+    stat = write_json_atomic(INDEX_FILE, index, ensure_ascii=False)
+    _index_cache = (stat.st_mtime_ns, index)
+
+
+def check_image(image_path: str, index: Dict) -> Optional[Dict]:
+    """
+    校验单张图片，文件大小和修改时间与索引中一致时直接返回索引中的元数据，不修改索引
+
+    Args:
+        image_path (str): 图片路径
+        index (Dict): 图片元数据索引
+
+    Returns:
+        Optional[Dict]: 图片元数据（不可用时包含error字段），文件不存在时返回None
+    """
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+
+    metadata = index.get(image_path)
+    if not metadata or metadata["size"] != stat.st_size or metadata["mtime"] != int(stat.st_mtime):
+        metadata = read_image_metadata(image_path)
+        if "error" in metadata:
+            logger.warning(f"跳过不可用的图片: {image_path}, 原因: {metadata['error']}")
+    return metadata
+
+
+@profiled("stage:validate_images")
+def validate_images(image_paths: List[str], save: bool = True) -> Tuple[List[str], Dict]:
+    """
+    校验图片并更新元数据索引，文件大小和修改时间未变化的图片直接使用索引中的结果
+
+    Args:
+        image_paths (List[str]): 图片路径列表
+        save (bool): 是否保存更新后的索引，分片扫描的工作进程不写共享索引，由合并步骤统一保存
+
+    Returns:
+        Tuple[List[str], Dict]: 可用的图片路径列表和更新后的索引
+    """
+    index = dict(load_image_index())
+    valid_paths = []
+    changed = False
+
+    for image_path in image_paths:
+        metadata = check_image(image_path, index)
+        if metadata is None:
+            continue
+        if index.get(image_path) is not metadata:
+            index[image_path] = metadata
+            changed = True
+        if "error" not in metadata:
+            valid_paths.append(image_path)
+
+    if changed and save:
+        save_image_index(index)
+    return valid_paths, index
+
+
+def get_sort_time(metadata: Dict) -> str:
+    """
+    获取用于排序和按日期过滤的时间，优先使用EXIF拍摄时间，否则使用文件修改时间
+
+    Args:
+        metadata (Dict): 图片元数据
+
+    Returns:
+        str: ISO格式的时间
+    """
+    return metadata.get("captured_at") or datetime.fromtimestamp(metadata.get("mtime", 0)).isoformat()
+
+
+def get_resolution(metadata: Dict) -> int:
+    """
+    获取图片像素数
+
+    Args:
+        metadata (Dict): 图片元数据
+
+    Returns:
+        int: 宽 * 高
+    """
+    return metadata.get("width", 0) * metadata.get("height", 0)
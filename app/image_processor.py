@@ -1,9 +1,16 @@
 import os
 import json
+import time
 import logging
 from typing import Dict, List, Tuple
-from config import IMAGE_DIRECTORIES, CACHE_FILE, SUPPORTED_FORMATS
-from utils import get_cache_data, generate_md5_path
+from config import IMAGE_DIRECTORIES, SUPPORTED_FORMATS, SCAN_CHECKPOINT_INTERVAL, SCAN_STATE_FILE
+from utils import (get_cache_data, save_cache_data, generate_md5_path, get_file_mtime, invalidate_image_url,
+                   write_json_atomic, CACHE_WRITE_LOCK)
+from image_index import validate_images
+from cache_stats import (STATUS_SUCCESS, STATUS_FAILED, STATUS_ERROR, load_statistics, rebuild_statistics,
+                         save_statistics, update_entry, start_scan, record_scan_result, finish_scan)
+from scan_scheduler import order_scan_work, TokenBudget
+from profiler import profiled
 from dashscope import MultiModalConversation
 import dashscope
 from config import DASHSCOPE_API_KEY
@@ -16,6 +23,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@profiled("stage:collect_images")
 def collect_images_from_directories(directories: List[str]) -> List[str]:
     """
     从多个目录收集图片文件路径
@@ -37,6 +45,7 @@ def collect_images_from_directories(directories: List[str]) -> List[str]:
     return image_paths
 
 
+@profiled("stage:process_single_image")
 def process_single_image(image_path: str) -> Dict:
     """
     处理单张图片，获取标签信息
@@ -124,7 +133,9 @@ def process_single_image(image_path: str) -> Dict:
                 "labels": labels,
                 "token_usage": token_usage,
                 "md5_path": md5_path,
-                "real_path": image_path
+                "real_path": image_path,
+                "status": STATUS_SUCCESS,
+                "mtime": get_file_mtime(image_path)
             }
         else:
             error_msg = f"处理失败: {response.message}"
@@ -135,7 +146,9 @@ def process_single_image(image_path: str) -> Dict:
                 "labels": error_msg,
                 "token_usage": {},
                 "md5_path": md5_path,
-                "real_path": image_path
+                "real_path": image_path,
+                "status": STATUS_FAILED,
+                "mtime": get_file_mtime(image_path)
             }
     except Exception as e:
         error_msg = f"处理异常: {str(e)}"
@@ -146,65 +159,141 @@ def process_single_image(image_path: str) -> Dict:
             "labels": error_msg,
             "token_usage": {},
             "md5_path": md5_path,
-            "real_path": image_path
+            "real_path": image_path,
+            "status": STATUS_ERROR,
+            "mtime": get_file_mtime(image_path)
         }
 
 
-def process_images(directories: List[str] = None, incremental: bool = True) -> Dict:
+def process_images(directories: List[str] = None, incremental: bool = True, priority: str = None,
+                   preferred_directories: List[str] = None, visible_paths: List[str] = None,
+                   scan_token_budget: int = None, daily_token_budget: int = None) -> Dict:
     """
     处理图片目录中的所有图片
     
     Args:
         directories (List[str], optional): 图片目录列表，默认使用配置中的IMAGE_DIRECTORIES
         incremental (bool): 是否增量处理，True表示只处理未处理过的图片，False表示全量处理
+        priority (str, optional): 处理顺序的优先级配置，默认使用配置中的SCAN_PRIORITY
+        preferred_directories (List[str], optional): 优先处理的目录
+        visible_paths (List[str], optional): 画廊中当前可见的图片，优先处理
+        scan_token_budget (int, optional): 本次扫描的token预算，默认使用配置中的SCAN_TOKEN_BUDGET
+        daily_token_budget (int, optional): 每日token预算，默认使用配置中的DAILY_TOKEN_BUDGET
         
     Returns:
-        Dict: 处理结果，包括处理的图片数量、token消耗和缓存数据
+        Dict: 处理结果，包括处理的图片数量、token消耗、缓存数据、停止原因和剩余图片数
     """
     # 如果没有提供目录，则使用配置中的目录
     if directories is None:
         directories = IMAGE_DIRECTORIES
     
-    # 获取现有缓存数据
-    cache = get_cache_data() if incremental else {}
+    # 收集所有图片路径，并在调用模型前跳过空文件、超大文件和损坏的图片
+    image_paths, image_index = validate_images(collect_images_from_directories(directories))
     
-    # 收集所有图片路径
-    image_paths = collect_images_from_directories(directories)
+    # 扫描期间持有缓存写入锁，缓存回收等其他写入方不会与扫描交替写入
+    with CACHE_WRITE_LOCK:
+        # 获取现有缓存数据，统计聚合随结果写入增量维护
+        cache = get_cache_data()
+        if incremental:
+            stats = load_statistics()
+        else:
+            # 全量处理时只保留本次扫描范围内的图片，旧结果在重新处理前保留，预算中断时不会丢失
+            cache = {image_path: cache[image_path] for image_path in image_paths if image_path in cache}
+            stats = rebuild_statistics(cache)
+    
+        # 按优先级排列待处理的图片，上次因预算中断而未处理的图片即使已有缓存（全量扫描中断时）也重新处理
+        resume_paths = _load_resume_paths()
+        resume_set = set(resume_paths)
+        pending = [image_path for image_path in image_paths
+                   if not (incremental and image_path in cache and image_path not in resume_set)]
+        pending = order_scan_work(pending, image_index, priority, preferred_directories, visible_paths)
     
-    # 统计信息
-    processed_count = 0
-    total_tokens = 0
+        # 统计信息，已处理过的图片的token计入总消耗
+        processed_count = 0
+        total_tokens = sum(cache[image_path].get("token_usage", {}).get("total_tokens", 0)
+                           for image_path in image_paths
+                           if incremental and image_path in cache and image_path not in resume_set)
+        stopped_reason = None
+        last_checkpoint = time.monotonic()
     
-    # 处理每张图片
-    for image_path in image_paths:
-        # 如果是增量处理且图片已处理过，则跳过
-        if incremental and image_path in cache:
-            total_tokens += cache[image_path].get("token_usage", {}).get("total_tokens", 0)
-            continue
+        tokens_per_image = stats["tokens"]["total_tokens"] // stats["processed_images"] if stats["processed_images"] else 0
+        budget = TokenBudget(scan_token_budget, daily_token_budget, estimate=tokens_per_image)
+        start_scan(stats)
+    
+        # 处理每张图片
+        for image_path in pending:
+            # 超出预算时停止，已处理的结果和剩余图片列表会保存，下次增量扫描从剩余图片继续
+            stopped_reason = budget.check()
+            if stopped_reason:
+                logger.info(f"达到token预算，停止扫描: {stopped_reason}, 剩余图片数: {len(pending) - processed_count}")
+                break
+        
+            # 处理图片
+            result = process_single_image(image_path)
+            tokens = result.get("token_usage", {}).get("total_tokens", 0)
+            budget.spend(tokens)
         
-        # 处理图片
-        result = process_single_image(image_path)
+            # 更新缓存和统计聚合
+            update_entry(stats, image_path, cache.get(image_path), result)
+            record_scan_result(stats, result)
+            cache[image_path] = result
+            invalidate_image_url(image_path)
         
-        # 更新缓存
-        cache[image_path] = result
+            # 更新统计信息
+            processed_count += 1
+            total_tokens += tokens
         
-        # 更新统计信息
-        processed_count += 1
-        total_tokens += result.get("token_usage", {}).get("total_tokens", 0)
+            # 按时间间隔保存进度，画廊可以尽早看到结果，中断后也不会丢失；
+            # 每次保存都要重写整个缓存文件，按张数保存会使总耗时随图片数平方增长
+            if time.monotonic() - last_checkpoint >= SCAN_CHECKPOINT_INTERVAL:
+                save_cache_data(cache)
+                save_statistics(stats)
+                budget.save()
+                last_checkpoint = time.monotonic()
     
-    # 保存缓存
-    with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
+        # 保存缓存和统计聚合
+        finish_scan(stats)
+        save_cache_data(cache)
+        save_statistics(stats)
+        budget.save()
+    
+        # 保存剩余图片列表：本次扫描范围外的原有记录保留，范围内的以本次剩余的图片为准
+        scanned = set(image_paths)
+        remaining = pending[processed_count:] if stopped_reason else []
+        _save_resume_paths([image_path for image_path in resume_paths if image_path not in scanned] + remaining)
     
     logger.info(f"处理完成 - 处理图片数: {processed_count}, 总token消耗: {total_tokens}")
     
     return {
         "processed_count": processed_count,
         "total_tokens": total_tokens,
-        "cache": cache
+        "cache": cache,
+        "stopped_reason": stopped_reason,
+        "remaining_count": len(pending) - processed_count
     }
 
 
+def _load_resume_paths() -> List[str]:
+    """
+    读取上次因预算中断而未处理的图片列表
+    """
+    try:
+        with open(SCAN_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f).get("pending", [])
+    except FileNotFoundError:
+        return []
+
+
+def _save_resume_paths(image_paths: List[str]) -> None:
+    """
+    保存未处理的图片列表，列表为空时删除状态文件
+    """
+    if image_paths:
+        write_json_atomic(SCAN_STATE_FILE, {"pending": image_paths, "updated_at": time.time()}, ensure_ascii=False)
+    elif os.path.exists(SCAN_STATE_FILE):
+        os.remove(SCAN_STATE_FILE)
+
+
 def load_cache() -> Dict:
     """
     加载缓存数据
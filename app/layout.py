@@ -1,6 +1,6 @@
 import dash_bootstrap_components as dbc
 from dash import html, dcc
-from config import IMAGE_DIRECTORIES
+from config import IMAGE_DIRECTORIES, SCAN_PRIORITY
 
 
 def create_layout():
@@ -35,6 +35,26 @@ def create_layout():
                                     style={"borderRadius": "0 8px 8px 0", "border": "1px solid #e0e0e0"})
                         ], className="mb-3"),
                         html.Small("支持多个目录，用逗号分隔", className="form-text text-muted mb-3"),
+                        dbc.InputGroup([
+                            dbc.InputGroupText("优先目录", 
+                                             style={"borderRadius": "8px 0 0 8px", "border": "1px solid #e0e0e0"}),
+                            dbc.Input(id="priority-directories", type="text", placeholder="可选，用逗号分隔",
+                                    style={"borderRadius": "0 8px 8px 0", "border": "1px solid #e0e0e0"})
+                        ], className="mb-3 mt-3"),
+                        dbc.InputGroup([
+                            dbc.InputGroupText("Token预算", 
+                                             style={"borderRadius": "8px 0 0 8px", "border": "1px solid #e0e0e0"}),
+                            dbc.Input(id="scan-token-budget", type="number", min=0, placeholder="本次扫描上限，可选",
+                                    style={"borderRadius": "0 8px 8px 0", "border": "1px solid #e0e0e0"})
+                        ], className="mb-3"),
+                        dcc.Dropdown(id="scan-priority", value=SCAN_PRIORITY, clearable=False,
+                                     options=[
+                                         {"label": "可见图片 > 优先目录 > 最新修改", "value": "visible,directories,mtime"},
+                                         {"label": "优先目录 > 最新修改", "value": "directories,mtime"},
+                                         {"label": "最新修改优先", "value": "mtime"},
+                                         {"label": "目录遍历顺序", "value": "walk"}
+                                     ],
+                                     className="mb-3", style={"fontSize": "14px"}),
                         dbc.Button("全量扫描", id="full-scan", 
                                  style={"borderRadius": "8px", "marginRight": "10px", 
                                         "backgroundColor": "#007AFF", "border": "none"}),
@@ -54,7 +74,15 @@ def create_layout():
                         html.P(id="processed-images", children="已处理图片数: 0", 
                               style={"marginBottom": "5px", "fontSize": "14px", "color": "#666"}),
                         html.P(id="total-tokens", children="总Token消耗: 0", 
-                              style={"marginBottom": "0", "fontSize": "14px", "color": "#666"})
+                              style={"marginBottom": "5px", "fontSize": "14px", "color": "#666"}),
+                        html.P(id="token-breakdown", 
+                              style={"marginBottom": "5px", "fontSize": "12px", "color": "#999"}),
+                        html.P(id="status-counts", 
+                              style={"marginBottom": "5px", "fontSize": "12px", "color": "#999"}),
+                        html.P(id="scan-rate", 
+                              style={"marginBottom": "5px", "fontSize": "12px", "color": "#999"}),
+                        html.Div(id="directory-stats", 
+                                style={"fontSize": "12px", "color": "#999"})
                     ])
                 ], style={"borderRadius": "12px", "boxShadow": "0 2px 10px rgba(0,0,0,0.05)", "border": "none", 
                          "marginTop": "20px"})
@@ -78,6 +106,29 @@ def create_layout():
                     dbc.CardBody([
                         html.H5("图片展示", className="card-title", 
                                style={"fontWeight": "500", "marginBottom": "15px"}),
+                        # 排序与过滤（基于图片元数据索引，无需打开图片文件）
+                        html.Div([
+                            dcc.Dropdown(id="gallery-sort", value="default", clearable=False,
+                                         options=[
+                                             {"label": "默认顺序", "value": "default"},
+                                             {"label": "拍摄时间（最新）", "value": "date_desc"},
+                                             {"label": "拍摄时间（最早）", "value": "date_asc"},
+                                             {"label": "分辨率（最高）", "value": "resolution_desc"}
+                                         ],
+                                         style={"width": "180px", "fontSize": "14px"}),
+                            dcc.Dropdown(id="gallery-min-resolution", value=0, clearable=False,
+                                         options=[
+                                             {"label": "全部分辨率", "value": 0},
+                                             {"label": "≥100万像素", "value": 1000000},
+                                             {"label": "≥400万像素", "value": 4000000},
+                                             {"label": "≥800万像素", "value": 8000000}
+                                         ],
+                                         style={"width": "160px", "fontSize": "14px"}),
+                            dcc.DatePickerRange(id="gallery-date-range", display_format="YYYY-MM-DD",
+                                                start_date_placeholder_text="开始日期",
+                                                end_date_placeholder_text="结束日期",
+                                                clearable=True)
+                        ], style={"display": "flex", "flexWrap": "wrap", "gap": "10px", "marginBottom": "15px"}),
                         html.Div(id="image-gallery", children=[], 
                                style={
                                    "display": "flex",
@@ -101,6 +152,9 @@ def create_layout():
         # 存储缓存数据
         dcc.Store(id="cache-data", data={}),
         
+        # 存储画廊中当前可见的图片，扫描时优先处理
+        dcc.Store(id="visible-images", data=[]),
+        
         # 存储选中的标签
         dcc.Store(id="selected-tag-storage", storage_type="session")
         
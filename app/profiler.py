@@ -0,0 +1,221 @@
+import os
+import sys
+import time
+import heapq
+import functools
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable, Dict
+from config import PROFILING_ENABLED, PROFILE_WINDOW_SECONDS, PROFILE_WINDOW_COUNT, PROFILE_SAMPLE_INTERVAL
+
+# 每个窗口保留的最慢调用数
+SLOWEST_PER_WINDOW = 100
+
+# 运行时开关，可通过管理接口随时修改，无需重启
+_state = {"enabled": PROFILING_ENABLED, "sampling": False}
+_lock = threading.Lock()
+# 滚动窗口，每个窗口记录调用耗时统计、最慢调用和采样到的调用栈
+_windows = deque(maxlen=PROFILE_WINDOW_COUNT)
+_sampler_thread = None
+
+
+def _current_window() -> Dict:
+    """
+    获取当前时间所在的窗口，需在持有_lock时调用
+    """
+    now = time.time()
+    start = now - now % PROFILE_WINDOW_SECONDS
+    if not _windows or _windows[-1]["start"] != start:
+        _windows.append({"start": start, "calls": {}, "slowest": [], "stacks": Counter()})
+    return _windows[-1]
+
+
+def record_call(name: str, duration: float, started_at: float) -> None:
+    """
+    记录一次调用的耗时
+
+    Args:
+        name (str): 调用名称
+        duration (float): 耗时（秒）
+        started_at (float): 开始时间戳
+    """
+    with _lock:
+        window = _current_window()
+        stat = window["calls"].setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        stat["count"] += 1
+        stat["total"] += duration
+        stat["max"] = max(stat["max"], duration)
+
+        # 用小顶堆保留最慢的调用
+        item = (duration, started_at, name)
+        if len(window["slowest"]) < SLOWEST_PER_WINDOW:
+            heapq.heappush(window["slowest"], item)
+        elif duration > window["slowest"][0][0]:
+            heapq.heapreplace(window["slowest"], item)
+
+
+def profiled(name: str) -> Callable:
+    """
+    装饰器：开启性能分析时记录函数耗时，关闭时只有一次判断的开销
+
+    Args:
+        name (str): 调用名称
+
+    Returns:
+        Callable: 装饰器
+    """
+    def decorator(func):
+        if getattr(func, "_profiled", False):
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state["enabled"]:
+                return func(*args, **kwargs)
+            started_at = time.time()
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_call(name, time.perf_counter() - start, started_at)
+
+        wrapper._profiled = True
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile_section(name: str):
+    """
+    记录代码块耗时，用于函数内部的阶段
+
+    Args:
+        name (str): 阶段名称
+    """
+    if not _state["enabled"]:
+        yield
+        return
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_call(name, time.perf_counter() - start, started_at)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample_loop() -> None:
+    """
+    定期采样所有线程的调用栈，按折叠格式（根;...;叶）计数
+    """
+    me = threading.get_ident()
+    while _state["enabled"] and _state["sampling"]:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            folded = ";".join(reversed(stack))
+            with _lock:
+                _current_window()["stacks"][folded] += 1
+        time.sleep(PROFILE_SAMPLE_INTERVAL)
+
+
+def enable_profiling(sampling: bool = False) -> None:
+    """
+    开启性能分析
+
+    Args:
+        sampling (bool): 是否同时开启调用栈采样（用于生成火焰图）
+    """
+    global _sampler_thread
+    _state["enabled"] = True
+    _state["sampling"] = sampling
+    if sampling and (_sampler_thread is None or not _sampler_thread.is_alive()):
+        _sampler_thread = threading.Thread(target=_sample_loop, name="profiler-sampler", daemon=True)
+        _sampler_thread.start()
+
+
+def disable_profiling() -> None:
+    """
+    关闭性能分析，已收集的数据保留在滚动窗口中
+    """
+    _state["enabled"] = False
+    _state["sampling"] = False
+
+
+def get_profile_report(top: int = 20) -> Dict:
+    """
+    汇总滚动窗口中的调用耗时
+
+    Args:
+        top (int): 返回最慢调用的数量
+
+    Returns:
+        Dict: 开关状态、各调用的次数/总耗时/平均耗时/最大耗时（按总耗时排序）和最慢的调用
+    """
+    with _lock:
+        windows = list(_windows)
+        calls = {}
+        slowest = []
+        for window in windows:
+            for name, stat in window["calls"].items():
+                total = calls.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+                total["count"] += stat["count"]
+                total["total"] += stat["total"]
+                total["max"] = max(total["max"], stat["max"])
+            slowest.extend(window["slowest"])
+
+    return {
+        "enabled": _state["enabled"],
+        "sampling": _state["sampling"],
+        "window_seconds": PROFILE_WINDOW_SECONDS,
+        "windows": [{"start": window["start"], "calls": sum(s["count"] for s in window["calls"].values()),
+                     "samples": sum(window["stacks"].values())} for window in windows],
+        "calls": [
+            {"name": name, "count": stat["count"], "total": stat["total"],
+             "avg": stat["total"] / stat["count"], "max": stat["max"]}
+            for name, stat in sorted(calls.items(), key=lambda item: item[1]["total"], reverse=True)
+        ],
+        "slowest": [
+            {"name": name, "duration": duration, "started_at": started_at}
+            for duration, started_at, name in heapq.nlargest(top, slowest)
+        ]
+    }
+
+
+def get_folded_stacks() -> str:
+    """
+    汇总滚动窗口中采样到的调用栈，输出折叠格式，可直接用于flamegraph.pl或speedscope
+
+    Returns:
+        str: 每行一个调用栈及其采样次数
+    """
+    with _lock:
+        stacks = Counter()
+        for window in _windows:
+            stacks.update(window["stacks"])
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+
+def instrument_dash_app(app) -> None:
+    """
+    为已注册的Dash回调和Flask路由添加耗时记录，需在所有回调和路由注册之后调用
+
+    Args:
+        app: Dash应用实例
+    """
+    for callback in app.callback_map.values():
+        func = callback["callback"]
+        callback["callback"] = profiled(f"callback:{func.__name__}")(func)
+
+    server = app.server
+    for endpoint, view in list(server.view_functions.items()):
+        server.view_functions[endpoint] = profiled(f"route:{endpoint}")(view)
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import datetime
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+from config import SCAN_PRIORITY, SCAN_TOKEN_BUDGET, DAILY_TOKEN_BUDGET, BUDGET_FILE
+from utils import write_json_atomic
+
+# 调度优先级
+PRIORITY_VISIBLE = "visible"
+PRIORITY_DIRECTORIES = "directories"
+PRIORITY_MTIME = "mtime"
+PRIORITY_WALK = "walk"
+
+# 预算停止原因
+STOP_SCAN_BUDGET = "scan_budget"
+STOP_DAILY_BUDGET = "daily_budget"
+
+# 用量文件锁的过期时间（秒），持有者只在读写用量文件的短时间内持有锁
+LOCK_STALE_SECONDS = 30
+
+
+def parse_priority(priority: Optional[str]) -> List[str]:
+    """
+    解析逗号分隔的优先级配置
+
+    Args:
+        priority (str, optional): 优先级配置，默认使用SCAN_PRIORITY
+
+    Returns:
+        List[str]: 优先级列表，按重要程度排列
+    """
+    if priority is None:
+        priority = SCAN_PRIORITY
+    return [p.strip() for p in priority.split(",") if p.strip() and p.strip() != PRIORITY_WALK]
+
+
+def order_scan_work(image_paths: List[str], image_index: Dict, priority: Optional[str] = None,
+                    preferred_directories: Optional[Iterable[str]] = None,
+                    visible_paths: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    按优先级排列待处理的图片，优先级相同时保持目录遍历顺序
+
+    Args:
+        image_paths (List[str]): 待处理的图片路径
+        image_index (Dict): 图片元数据索引，用于获取修改时间而无需再次stat
+        priority (str, optional): 优先级配置，默认使用SCAN_PRIORITY
+        preferred_directories (Iterable[str], optional): 优先处理的目录
+        visible_paths (Iterable[str], optional): 画廊中当前可见的图片（都已有缓存，增量扫描中不会出现）
+
+    Returns:
+        List[str]: 排序后的图片路径
+    """
+    priorities = parse_priority(priority)
+    if not priorities:
+        return list(image_paths)
+
+    preferred = tuple(os.path.join(os.path.abspath(d), "") for d in preferred_directories or [])
+    visible = set(visible_paths or [])
+
+    def sort_key(image_path: str) -> tuple:
+        key = []
+        for p in priorities:
+            if p == PRIORITY_VISIBLE:
+                key.append(image_path not in visible)
+            elif p == PRIORITY_DIRECTORIES:
+                key.append(not (preferred and os.path.abspath(image_path).startswith(preferred)))
+            elif p == PRIORITY_MTIME:
+                key.append(-image_index.get(image_path, {}).get("mtime", 0))
+        return tuple(key)
+
+    # sorted是稳定排序，优先级相同的图片保持原有顺序
+    return sorted(image_paths, key=sort_key)
+
+
+@contextmanager
+def _file_lock(path: str):
+    """
+    跨进程的文件锁：以O_EXCL创建锁文件，持有者异常退出遗留的锁文件超过LOCK_STALE_SECONDS后被清除
+
+    Args:
+        path (str): 被保护的文件路径
+    """
+    lock_file = f"{path}.lock"
+    while True:
+        try:
+            os.close(os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_file) > LOCK_STALE_SECONDS:
+                    os.remove(lock_file)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.remove(lock_file)
+
+
+def _merge_usage(path: str, key: str, tokens: int, keep: Optional[int] = None) -> int:
+    """
+    在文件锁内重新读取用量文件，累加本进程新增的用量后写回，多个扫描同时保存时不会丢失对方的用量
+
+    Args:
+        path (str): 用量文件
+        key (str): 用量键（日期或扫描）
+        tokens (int): 本进程自上次保存以来新增的用量
+        keep (int, optional): 只保留按键排序的最后若干项
+
+    Returns:
+        int: 合并后该键的总用量
+    """
+    with _file_lock(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                usage = json.load(f)
+        except FileNotFoundError:
+            usage = {}
+        if tokens:
+            usage[key] = usage.get(key, 0) + tokens
+            if keep:
+                usage = dict(sorted(usage.items())[-keep:])
+            write_json_atomic(path, usage)
+    return usage.get(key, 0)
+
+
+class TokenBudget:
+    """
+    单次扫描和每日token预算，每日用量保存在BUDGET_FILE中，跨扫描、进程和重启累计
+
+    保存时在文件锁内重新读取并合并用量，同时运行的扫描（包括分片扫描的各个工作进程）
+    共享同一份每日用量；指定scan_usage_file时单次扫描的用量也在多个进程间共享。
+    """
+
+    def __init__(self, scan_budget: Optional[int] = None, daily_budget: Optional[int] = None,
+                 estimate: int = 0, scan_usage_file: Optional[str] = None):
+        """
+        Args:
+            scan_budget (int, optional): 单次扫描预算，默认使用SCAN_TOKEN_BUDGET，0表示不限制
+            daily_budget (int, optional): 每日预算，默认使用DAILY_TOKEN_BUDGET，0表示不限制
+            estimate (int): 处理一张图片的预估token数，用于在超出预算前停止
+            scan_usage_file (str, optional): 多个进程共同完成一次扫描时，保存本次扫描用量的文件
+        """
+        self.scan_budget = SCAN_TOKEN_BUDGET if scan_budget is None else scan_budget
+        self.daily_budget = DAILY_TOKEN_BUDGET if daily_budget is None else daily_budget
+        # 本进程的用量和处理数
+        self.scan_spent = 0
+        self.processed = 0
+        self._estimate = estimate
+        self._today = datetime.date.today().isoformat()
+        self._scan_usage_file = scan_usage_file
+        # 上次保存时文件中的用量（包括其他进程的用量）和本进程尚未保存的用量
+        self._saved_daily = 0
+        self._saved_scan = 0
+        self._unsaved = 0
+        self.save()
+
+    @property
+    def daily_spent(self) -> int:
+        return self._saved_daily + self._unsaved
+
+    @property
+    def shared_scan_spent(self) -> int:
+        return self._saved_scan + self._unsaved if self._scan_usage_file else self.scan_spent
+
+    @property
+    def estimate(self) -> int:
+        # 已处理过图片时使用本次扫描的平均值
+        return self.scan_spent // self.processed if self.processed else self._estimate
+
+    def check(self) -> Optional[str]:
+        """
+        检查处理下一张图片是否会超出预算
+
+        Returns:
+            Optional[str]: 超出预算时返回停止原因，否则返回None
+        """
+        if self.scan_budget and self.shared_scan_spent + self.estimate > self.scan_budget:
+            return STOP_SCAN_BUDGET
+        if self.daily_budget and self.daily_spent + self.estimate > self.daily_budget:
+            return STOP_DAILY_BUDGET
+        return None
+
+    def spend(self, tokens: int) -> None:
+        """
+        记录处理一张图片消耗的token
+
+        Args:
+            tokens (int): 消耗的token数
+        """
+        self.scan_spent += tokens
+        self.processed += 1
+        self._unsaved += tokens
+
+    def save(self) -> None:
+        """
+        保存本进程新增的用量并读取其他进程的最新用量，每日用量只保留最近30天的记录
+        """
+        self._saved_daily = _merge_usage(BUDGET_FILE, self._today, self._unsaved, keep=30)
+        if self._scan_usage_file:
+            self._saved_scan = _merge_usage(self._scan_usage_file, "scan", self._unsaved)
+        self._unsaved = 0
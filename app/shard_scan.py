@@ -0,0 +1,437 @@
+"""
+分片扫描：将图片集合按路径哈希划分为多个分片，由多个进程或多台主机协同处理。
+
+共享目录结构（SHARD_DIR/<scan_id>/）:
+    manifest.json          扫描清单，记录分片数量和开始时间
+    leases/<bucket>.lease  分片租约，持有者需在SHARD_LEASE_TTL秒内续约，否则可被其他进程接管
+    results/<bucket>.json  分片处理结果（按SCAN_CHECKPOINT_INTERVAL定期保存，接管时从此处继续）
+    results/<bucket>.index.json  分片内图片的元数据（合并时统一写入元数据索引）
+    done/<bucket>          分片完成标记
+    budget.json            本次扫描各工作进程共享的token用量（用于SCAN_TOKEN_BUDGET）
+    merged.json            合并完成标记及合并结果
+"""
+import os
+import json
+import time
+import socket
+import tempfile
+import hashlib
+import logging
+import argparse
+import multiprocessing
+from typing import Callable, Dict, List, Optional
+from config import IMAGE_DIRECTORIES, SHARD_DIR, SHARD_LEASE_TTL, SHARD_BUCKETS_PER_WORKER, SCAN_CHECKPOINT_INTERVAL
+from utils import get_cache_data, save_cache_data, invalidate_image_url, write_json_atomic, CACHE_WRITE_LOCK
+from cache_stats import load_statistics, save_statistics, update_entry, start_scan, record_scan_result, finish_scan
+from image_index import check_image, load_image_index, save_image_index
+from image_processor import collect_images_from_directories, process_single_image
+from scan_scheduler import TokenBudget
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 合并结果使用的租约名
+MERGE_LEASE = "merge"
+
+
+def get_bucket(image_path: str, bucket_count: int) -> int:
+    """
+    根据图片路径哈希计算所属分片
+
+    Args:
+        image_path (str): 图片路径
+        bucket_count (int): 分片数量
+
+    Returns:
+        int: 分片编号
+    """
+    return int(hashlib.md5(image_path.encode('utf-8')).hexdigest(), 16) % bucket_count
+
+
+def _read_json(path: str, default=None):
+    """
+    读取JSON文件，文件不存在时返回默认值
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def init_scan(scan_dir: str, bucket_count: int) -> Dict:
+    """
+    初始化扫描清单，已存在时沿用已有清单（以第一个创建者的分片数量为准）
+
+    Args:
+        scan_dir (str): 本次扫描的共享目录
+        bucket_count (int): 分片数量
+
+    Returns:
+        Dict: 扫描清单
+    """
+    for sub_dir in ("leases", "results", "done"):
+        os.makedirs(os.path.join(scan_dir, sub_dir), exist_ok=True)
+
+    # 先写临时文件再硬链接为清单，硬链接在目标已存在时失败，保证清单只被创建一次且内容完整
+    manifest_file = os.path.join(scan_dir, "manifest.json")
+    fd, tmp_file = tempfile.mkstemp(dir=scan_dir, prefix="manifest.", suffix=".tmp")
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({"bucket_count": bucket_count, "created_at": time.time()}, f)
+    try:
+        os.link(tmp_file, manifest_file)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_file)
+    return _read_json(manifest_file)
+
+
+def _lease_path(scan_dir: str, name) -> str:
+    return os.path.join(scan_dir, "leases", f"{name}.lease")
+
+
+def acquire_lease(scan_dir: str, name, worker_id: str) -> bool:
+    """
+    尝试获取租约，租约已过期（持有者未按时续约）时接管
+
+    Args:
+        scan_dir (str): 本次扫描的共享目录
+        name: 租约名（分片编号或MERGE_LEASE）
+        worker_id (str): 工作进程标识
+
+    Returns:
+        bool: 是否获取成功
+    """
+    lease_file = _lease_path(scan_dir, name)
+    expired_file = f"{lease_file}.expired.{worker_id}"
+    try:
+        with open(lease_file, 'r', encoding='utf-8') as f:
+            holder = f.read()
+        if time.time() - os.path.getmtime(lease_file) < SHARD_LEASE_TTL:
+            return False
+        # 租约已过期，通过重命名原子地将其作废，只有一个进程能重命名成功
+        os.rename(lease_file, expired_file)
+    except FileNotFoundError:
+        pass
+    else:
+        # 检查与重命名之间持有者可能已续约，或租约已被其他进程接管后重新创建，
+        # 重命名后再次检查，租约仍然有效时恢复原租约（目标已存在时硬链接失败，不会覆盖新租约）
+        with open(expired_file, 'r', encoding='utf-8') as f:
+            renamed_holder = f.read()
+        if renamed_holder != holder or time.time() - os.path.getmtime(expired_file) < SHARD_LEASE_TTL:
+            try:
+                os.link(expired_file, lease_file)
+            except FileExistsError:
+                pass
+            os.remove(expired_file)
+            return False
+        os.remove(expired_file)
+        logger.warning(f"接管过期租约: lease={name}, holder={holder}, worker={worker_id}")
+
+    try:
+        fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(worker_id)
+    return True
+
+
+def renew_lease(scan_dir: str, name, worker_id: str) -> bool:
+    """
+    续约，租约已被其他进程接管时返回False
+
+    Args:
+        scan_dir (str): 本次扫描的共享目录
+        name: 租约名
+        worker_id (str): 工作进程标识
+
+    Returns:
+        bool: 是否仍持有租约
+    """
+    lease_file = _lease_path(scan_dir, name)
+    try:
+        with open(lease_file, 'r', encoding='utf-8') as f:
+            if f.read() != worker_id:
+                return False
+        os.utime(lease_file)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def release_lease(scan_dir: str, name, worker_id: str) -> None:
+    """
+    释放租约
+    """
+    if renew_lease(scan_dir, name, worker_id):
+        os.remove(_lease_path(scan_dir, name))
+
+
+def _is_done(scan_dir: str, bucket: int) -> bool:
+    return os.path.exists(os.path.join(scan_dir, "done", str(bucket)))
+
+
+def process_bucket(scan_dir: str, bucket: int, image_paths: List[str], worker_id: str,
+                   process_fn: Callable[[str], Dict] = process_single_image,
+                   budget: Optional[TokenBudget] = None) -> bool:
+    """
+    处理一个分片，从已保存的分片结果处继续
+
+    Args:
+        scan_dir (str): 本次扫描的共享目录
+        bucket (int): 分片编号
+        image_paths (List[str]): 分片内待处理的图片路径（未校验）
+        worker_id (str): 工作进程标识
+        process_fn (Callable): 单张图片处理函数
+        budget (TokenBudget, optional): token预算，与处理结果一起按时间间隔保存用量
+
+    Returns:
+        bool: 分片是否处理完成（租约被接管或达到预算时返回False）
+    """
+    result_file = os.path.join(scan_dir, "results", f"{bucket}.json")
+    index_file = os.path.join(scan_dir, "results", f"{bucket}.index.json")
+    results = _read_json(result_file, {})
+    # 本分片图片的元数据写入分片目录，不由多个进程同时改写共享索引
+    bucket_index = _read_json(index_file, {})
+    image_index = load_image_index()
+
+    def save_progress() -> None:
+        write_json_atomic(result_file, results, ensure_ascii=False)
+        write_json_atomic(index_file, bucket_index, ensure_ascii=False)
+        if budget is not None:
+            budget.save()
+
+    # 按时间间隔保存结果和用量，每张图片都重写分片结果会使总耗时随图片数平方增长
+    last_checkpoint = time.monotonic()
+    for image_path in image_paths:
+        if image_path in results:
+            continue
+        # 逐张校验，校验和处理交替进行，每张图片之后都续约，大分片的校验不会使租约过期
+        metadata = check_image(image_path, image_index)
+        if metadata is not None:
+            bucket_index[image_path] = metadata
+        if metadata is not None and "error" not in metadata:
+            stopped_reason = budget.check() if budget is not None else None
+            if stopped_reason:
+                logger.info(f"达到token预算，停止处理分片: bucket={bucket}, worker={worker_id}, reason={stopped_reason}")
+                save_progress()
+                return False
+            result = process_fn(image_path)
+            if budget is not None:
+                budget.spend(result.get("token_usage", {}).get("total_tokens", 0))
+        else:
+            result = None
+
+        # 记录结果前确认仍持有租约；租约已被接管时不再写入，避免覆盖接管者的结果
+        if not renew_lease(scan_dir, bucket, worker_id):
+            logger.warning(f"分片租约已被接管，放弃处理: bucket={bucket}, worker={worker_id}")
+            if budget is not None:
+                budget.save()
+            return False
+        if result is not None:
+            results[image_path] = result
+        if time.monotonic() - last_checkpoint >= SCAN_CHECKPOINT_INTERVAL:
+            save_progress()
+            last_checkpoint = time.monotonic()
+
+    save_progress()
+    open(os.path.join(scan_dir, "done", str(bucket)), 'w').close()
+    return True
+
+
+def run_shard_worker(directories: List[str], scan_id: str, worker_index: int, worker_count: int,
+                     incremental: bool = True, worker_id: Optional[str] = None,
+                     process_fn: Callable[[str], Dict] = process_single_image,
+                     scan_token_budget: Optional[int] = None, daily_token_budget: Optional[int] = None) -> int:
+    """
+    运行一个分片扫描工作进程，优先处理分配给自己的分片，完成后接管其他未完成或租约过期的分片
+
+    Args:
+        directories (List[str]): 图片目录列表
+        scan_id (str): 扫描标识，同一次扫描的所有工作进程需使用相同标识
+        worker_index (int): 工作进程序号（从0开始）
+        worker_count (int): 工作进程总数
+        incremental (bool): 是否跳过缓存中已处理的图片
+        worker_id (str, optional): 工作进程标识，默认使用主机名和进程号
+        process_fn (Callable): 单张图片处理函数
+        scan_token_budget (int, optional): 本次扫描（所有工作进程合计）的token预算，默认使用SCAN_TOKEN_BUDGET
+        daily_token_budget (int, optional): 每日token预算，默认使用DAILY_TOKEN_BUDGET
+
+    Returns:
+        int: 本进程处理完成的分片数
+    """
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    scan_dir = os.path.join(SHARD_DIR, scan_id)
+    manifest = init_scan(scan_dir, worker_count * SHARD_BUCKETS_PER_WORKER)
+    bucket_count = manifest["bucket_count"]
+
+    # 划分分片
+    cache = get_cache_data() if incremental else {}
+    buckets: Dict[int, List[str]] = {bucket: [] for bucket in range(bucket_count)}
+    # 此处不校验图片，每个分片在被领取后只校验自己的图片
+    for image_path in collect_images_from_directories(directories):
+        if incremental and image_path in cache:
+            continue
+        buckets[get_bucket(image_path, bucket_count)].append(image_path)
+
+    # 自己的分片在前，其他分片在后（用于接管慢节点或失效节点的工作）
+    own = [b for b in range(bucket_count) if b % worker_count == worker_index]
+    others = [b for b in range(bucket_count) if b % worker_count != worker_index]
+
+    # 每日用量与其他扫描共享，本次扫描的用量在所有工作进程间共享
+    stats = load_statistics()
+    tokens_per_image = stats["tokens"]["total_tokens"] // stats["processed_images"] if stats["processed_images"] else 0
+    budget = TokenBudget(scan_token_budget, daily_token_budget, estimate=tokens_per_image,
+                         scan_usage_file=os.path.join(scan_dir, "budget.json"))
+
+    completed = 0
+    stopped_reason = None
+    while not stopped_reason:
+        pending = [b for b in own + others if not _is_done(scan_dir, b)]
+        if not pending:
+            break
+        claimed = False
+        for bucket in pending:
+            # 读取其他进程的最新用量，达到预算时不再领取分片
+            budget.save()
+            stopped_reason = budget.check()
+            if stopped_reason:
+                break
+            if not acquire_lease(scan_dir, bucket, worker_id):
+                continue
+            claimed = True
+            logger.info(f"开始处理分片: bucket={bucket}, images={len(buckets[bucket])}, worker={worker_id}")
+            if process_bucket(scan_dir, bucket, buckets[bucket], worker_id, process_fn, budget):
+                completed += 1
+            release_lease(scan_dir, bucket, worker_id)
+        if not claimed and not stopped_reason:
+            # 剩余分片均被其他进程持有，等待完成或租约过期
+            time.sleep(min(SHARD_LEASE_TTL / 10, 5))
+
+    if stopped_reason:
+        # 未完成的分片保留已处理的结果，使用相同的扫描标识重新运行即可继续，也可以先合并已有结果
+        logger.info(f"达到token预算，分片扫描工作进程停止: worker={worker_id}, reason={stopped_reason}, "
+                    f"完成分片数: {completed}")
+        return completed
+    logger.info(f"分片扫描工作进程结束: worker={worker_id}, 完成分片数: {completed}")
+
+    # 所有分片完成后，由获取到合并租约的进程合并结果
+    if not os.path.exists(os.path.join(scan_dir, "merged.json")) and acquire_lease(scan_dir, MERGE_LEASE, worker_id):
+        merge_shard_results(scan_id)
+        release_lease(scan_dir, MERGE_LEASE, worker_id)
+    return completed
+
+
+def merge_shard_results(scan_id: str, force: bool = False) -> Dict:
+    """
+    将所有分片结果合并到缓存文件中，可重复执行
+
+    Args:
+        scan_id (str): 扫描标识
+        force (bool): 已合并过时是否重新合并
+
+    Returns:
+        Dict: 合并结果，包括合并的图片数量、token消耗和是否所有分片都已完成
+    """
+    scan_dir = os.path.join(SHARD_DIR, scan_id)
+    merged_file = os.path.join(scan_dir, "merged.json")
+    if not force and os.path.exists(merged_file):
+        return _read_json(merged_file)
+    manifest = _read_json(os.path.join(scan_dir, "manifest.json"))
+    if not manifest:
+        raise ValueError(f"扫描不存在: {scan_id}")
+
+    with CACHE_WRITE_LOCK:
+        cache = get_cache_data()
+        stats = load_statistics()
+        start_scan(stats)
+        stats["scan"]["started_at"] = manifest["created_at"]
+
+        merged_count = 0
+        total_tokens = 0
+        image_index = dict(load_image_index())
+        index_changed = False
+        for bucket in range(manifest["bucket_count"]):
+            bucket_index = _read_json(os.path.join(scan_dir, "results", f"{bucket}.index.json"), {})
+            if bucket_index:
+                image_index.update(bucket_index)
+                index_changed = True
+            results = _read_json(os.path.join(scan_dir, "results", f"{bucket}.json"), {})
+            for image_path, result in results.items():
+                update_entry(stats, image_path, cache.get(image_path), result)
+                record_scan_result(stats, result)
+                cache[image_path] = result
+                invalidate_image_url(image_path)
+                merged_count += 1
+                total_tokens += result.get("token_usage", {}).get("total_tokens", 0)
+
+        finish_scan(stats)
+        save_cache_data(cache)
+        save_statistics(stats)
+        if index_changed:
+            save_image_index(image_index)
+
+    # 有分片因预算中断未完成时只合并已有结果，不写入合并完成标记，继续扫描后可再次合并
+    complete = all(_is_done(scan_dir, bucket) for bucket in range(manifest["bucket_count"]))
+    logger.info(f"分片结果合并完成 - 合并图片数: {merged_count}, 总token消耗: {total_tokens}, 全部分片完成: {complete}")
+    summary = {
+        "merged_count": merged_count,
+        "total_tokens": total_tokens,
+        "complete": complete
+    }
+    if complete:
+        write_json_atomic(merged_file, summary, ensure_ascii=False)
+    return summary
+
+
+def run_local_workers(directories: List[str], scan_id: str, worker_count: int,
+                      incremental: bool = True,
+                      process_fn: Callable[[str], Dict] = process_single_image) -> Dict:
+    """
+    在本机启动多个进程执行分片扫描，并在结束后合并结果
+
+    Args:
+        directories (List[str]): 图片目录列表
+        scan_id (str): 扫描标识
+        worker_count (int): 进程数量
+        incremental (bool): 是否跳过缓存中已处理的图片
+        process_fn (Callable): 单张图片处理函数，需为模块级函数以便传给子进程
+
+    Returns:
+        Dict: 合并结果
+    """
+    processes = [
+        multiprocessing.Process(target=run_shard_worker,
+                                args=(directories, scan_id, index, worker_count, incremental),
+                                kwargs={"process_fn": process_fn})
+        for index in range(worker_count)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return merge_shard_results(scan_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分片扫描图片目录")
+    parser.add_argument("mode", choices=["worker", "local", "merge"],
+                        help="worker: 作为一个工作进程运行; local: 在本机启动多个进程; merge: 合并分片结果")
+    parser.add_argument("--scan-id", required=True, help="扫描标识，同一次扫描的所有工作进程需一致")
+    parser.add_argument("--workers", type=int, default=1, help="工作进程总数")
+    parser.add_argument("--index", type=int, default=0, help="当前工作进程序号（worker模式）")
+    parser.add_argument("--directories", default=",".join(IMAGE_DIRECTORIES), help="图片目录，多个目录用逗号分隔")
+    parser.add_argument("--full", action="store_true", help="全量处理，不跳过已缓存的图片")
+    args = parser.parse_args()
+
+    dirs = [d.strip() for d in args.directories.split(",") if d.strip()]
+    if args.mode == "worker":
+        run_shard_worker(dirs, args.scan_id, args.index, args.workers, incremental=not args.full)
+    elif args.mode == "local":
+        run_local_workers(dirs, args.scan_id, args.workers, incremental=not args.full)
+    else:
+        merge_shard_results(args.scan_id, force=True)
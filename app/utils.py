@@ -2,11 +2,19 @@ import os
 import json
 import re
 import hashlib
-from typing import Dict, List
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
 from config import CACHE_FILE, IMAGE_DIRECTORIES
+from cache_snapshot import CacheSnapshot, open_snapshot, write_snapshot
+from profiler import profiled
 from urllib.parse import quote
 
+# 进程内的缓存写入锁：扫描、分片合并和缓存回收修改缓存时持有，避免互相覆盖对方的写入
+CACHE_WRITE_LOCK = threading.Lock()
 
+
+@profiled("stage:get_cache_data")
 def get_cache_data() -> Dict:
     """
     获取缓存数据
@@ -14,12 +22,56 @@ def get_cache_data() -> Dict:
     Returns:
         Dict: 缓存数据字典
     """
+    # 优先使用与cache.json一致的二进制快照
+    snapshot = open_snapshot()
+    if snapshot is not None:
+        return snapshot.to_dict()
     if os.path.exists(CACHE_FILE):
         with open(CACHE_FILE, 'r', encoding='utf-8') as f:
             return json.load(f)
     return {}
 
 
+def write_json_atomic(path: str, data, **dump_kwargs) -> os.stat_result:
+    """
+    写入JSON文件：先写同目录下的唯一临时文件再替换，多个进程或线程同时写入时不会互相覆盖临时文件
+
+    Args:
+        path (str): 目标文件路径
+        data: 要写入的数据
+        **dump_kwargs: 传给json.dump的参数
+
+    Returns:
+        os.stat_result: 替换前临时文件的状态，替换后目标文件的修改时间和大小与之相同
+    """
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, **dump_kwargs)
+            f.flush()
+            stat = os.fstat(f.fileno())
+        os.replace(tmp_file, path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return stat
+
+
+@profiled("stage:save_cache_data")
+def save_cache_data(cache_data: Dict) -> None:
+    """
+    保存缓存数据和二进制快照（先写临时文件再替换，避免读取方读到写了一半的文件）
+    
+    Args:
+        cache_data (Dict): 缓存数据字典
+    """
+    source = write_json_atomic(CACHE_FILE, cache_data, ensure_ascii=False, indent=2)
+    # 在JSON旁写入二进制快照，供其他进程快速加载
+    write_snapshot(cache_data, extract_image_tags, source)
+
+
 def calculate_total_tokens(cache_data: Dict) -> int:
     """
     计算总token使用量
@@ -36,6 +88,7 @@ def calculate_total_tokens(cache_data: Dict) -> int:
     return total
 
 
+@profiled("stage:extract_tags")
 def extract_tags(cache_data: Dict) -> List[str]:
     """
     从缓存数据中提取所有标签
@@ -48,16 +101,32 @@ def extract_tags(cache_data: Dict) -> List[str]:
     """
     tags = set()
     for data in cache_data.values():
-        labels = data.get("labels", "")
-        # 确保labels是字符串类型
-        if not isinstance(labels, str):
-            labels = str(labels)
-        # 使用正则表达式提取可能的标签（中文词汇）
-        extracted_tags = re.findall(r'[\u4e00-\u9fff]+', labels)
-        tags.update(extracted_tags)
+        # 已标记为文件缺失的条目不参与标签统计
+        if "missing_since" in data:
+            continue
+        tags.update(extract_image_tags(data.get("labels", "")))
     return sorted(list(tags))
 
 
+def extract_image_tags(labels) -> List[str]:
+    """
+    从单张图片的标签内容中提取标签
+    
+    Args:
+        labels: 标签内容，可以是字符串、列表或其他类型
+        
+    Returns:
+        List[str]: 标签列表
+    """
+    if isinstance(labels, list):
+        return [str(label) for label in labels]
+    # 确保labels是字符串类型
+    if not isinstance(labels, str):
+        labels = str(labels)
+    # 使用正则表达式提取可能的标签（中文词汇）
+    return re.findall(r'[\u4e00-\u9fff]+', labels)
+
+
 def simplify_labels(labels) -> str:
     """
     简化标签内容
@@ -99,30 +168,68 @@ def generate_md5_path(image_path: str) -> str:
     return f"{md5_hash}{ext}"
 
 
-def get_image_url(image_path: str, cache_data: Dict = None) -> str:
+def get_file_mtime(image_path: str) -> int:
     """
-    获取图片的URL路径
+    获取文件修改时间，作为图片内容版本号
     
     Args:
         image_path (str): 图片路径
-        cache_data (Dict, optional): 缓存数据，用于查找MD5路径映射
         
     Returns:
-        str: 图片URL
+        int: 修改时间（秒），文件不存在时返回0
     """
-    # 如果提供了缓存数据，尝试查找MD5路径映射
-    if cache_data:
-        # 在缓存中查找该图片路径对应的MD5路径
-        image_info = cache_data.get(image_path)
-        if image_info and "md5_path" in image_info:
-            return f"/assets/{quote(image_info['md5_path'])}"
+    try:
+        return int(os.path.getmtime(image_path))
+    except OSError:
+        return 0
+
+
+# 启动时解析一次的图片根目录（绝对路径）
+IMAGE_ROOTS = [os.path.abspath(d) for d in IMAGE_DIRECTORIES]
+
+# 预计算的图片URL: 图片路径 -> (条目版本键, URL)
+_image_url_cache: Dict[str, Tuple[Optional[Tuple], str]] = {}
+
+
+def _content_version(image_info: Optional[Dict], metadata: Optional[Dict]) -> Optional[str]:
+    """
+    获取图片内容版本：优先使用元数据索引中当前的文件大小和修改时间（扫描时会重新stat），
+    文件被原地替换后版本随之变化；没有元数据时退回打标签时记录的修改时间
+    """
+    if metadata and "mtime" in metadata:
+        return f"{metadata['mtime']}-{metadata.get('size', 0)}"
+    if image_info and image_info.get("mtime"):
+        return str(image_info["mtime"])
+    return None
+
+
+def _image_url_key(image_info: Optional[Dict], metadata: Optional[Dict] = None) -> Optional[Tuple]:
+    """
+    生成缓存条目的版本键，条目的MD5路径或内容版本变化时URL需要重新生成
+    """
+    if not image_info:
+        return None
+    return image_info.get("md5_path"), _content_version(image_info, metadata)
+
+
+def _build_image_url(image_path: str, image_info: Optional[Dict], version: Optional[str] = None) -> str:
+    """
+    计算图片的URL路径（包含路径运算，只在预计算或条目变化时调用）
+    """
+    # 优先使用MD5路径映射，并附加内容版本号，图片更新后浏览器会重新请求
+    if image_info and "md5_path" in image_info:
+        url = f"/assets/{quote(image_info['md5_path'])}"
+        if version:
+            url += f"?v={version}"
+        return url
     
-    # 如果没有缓存数据或未找到映射，使用传统方法
+    # 如果没有找到映射，使用传统方法
     # 遍历所有配置的图片目录，找到匹配的目录
-    for image_directory in IMAGE_DIRECTORIES:
+    abs_path = os.path.abspath(image_path)
+    for image_root in IMAGE_ROOTS:
         try:
             # 尝试计算相对于当前目录的路径
-            rel_path = os.path.relpath(image_path, image_directory)
+            rel_path = os.path.relpath(abs_path, image_root)
             # 检查是否成功计算出相对路径（如果不是子路径，relpath会返回'..'开头的路径）
             if not rel_path.startswith('..'):
                 # 确保路径分隔符统一为正斜杠
@@ -133,4 +240,58 @@ def get_image_url(image_path: str, cache_data: Dict = None) -> str:
             continue
     
     # 如果在所有目录中都找不到匹配项，使用文件名
-    return f"/assets/{quote(os.path.basename(image_path))}"
\ No newline at end of file
+    return f"/assets/{quote(os.path.basename(image_path))}"
+
+
+def precompute_image_urls(cache_data: Dict, image_index: Optional[Dict] = None) -> None:
+    """
+    为缓存中的所有条目预计算图片URL
+    
+    Args:
+        cache_data (Dict): 缓存数据，传入快照时只读取路径和MD5路径列，不解码条目
+        image_index (Dict, optional): 图片元数据索引，用于生成内容版本号
+    """
+    image_index = image_index or {}
+    if isinstance(cache_data, CacheSnapshot):
+        items = ((image_path, {"md5_path": md5_path} if md5_path else {})
+                 for image_path, md5_path in cache_data.md5_rows())
+    else:
+        items = cache_data.items()
+    for image_path, image_info in items:
+        key = _image_url_key(image_info, image_index.get(image_path))
+        _image_url_cache[image_path] = (key, _build_image_url(image_path, image_info, key and key[1]))
+
+
+def invalidate_image_url(image_path: str) -> None:
+    """
+    缓存条目更新或删除时，使该条目的预计算URL失效
+    
+    Args:
+        image_path (str): 图片路径
+    """
+    _image_url_cache.pop(image_path, None)
+
+
+def get_image_url(image_path: str, cache_data: Dict = None, image_index: Dict = None) -> str:
+    """
+    获取图片的URL路径
+    
+    Args:
+        image_path (str): 图片路径
+        cache_data (Dict, optional): 缓存数据，用于查找MD5路径映射
+        image_index (Dict, optional): 图片元数据索引，用于生成内容版本号
+        
+    Returns:
+        str: 图片URL
+    """
+    image_info = cache_data.get(image_path) if cache_data else None
+    key = _image_url_key(image_info, image_index.get(image_path) if image_index else None)
+    
+    # 命中预计算的URL时直接返回，不做任何路径运算
+    cached = _image_url_cache.get(image_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    
+    url = _build_image_url(image_path, image_info, key and key[1])
+    _image_url_cache[image_path] = (key, url)
+    return url
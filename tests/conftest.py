@@ -0,0 +1,11 @@
+"""
+测试公共配置：应用模块在导入时读取环境变量，需在导入前指向临时目录
+"""
+import os
+import sys
+import tempfile
+
+WORK_DIR = tempfile.mkdtemp(prefix="image_tag_manager_test_")
+os.environ["CACHE_FILE"] = os.path.join(WORK_DIR, "cache.json")
+os.environ["IMAGE_DIRECTORIES"] = ""
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
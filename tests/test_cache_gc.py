@@ -0,0 +1,81 @@
+"""
+缓存回收测试：缺失文件的标记，以及存储疑似未挂载时的保护
+"""
+import os
+import shutil
+import cache_gc
+from config import CACHE_FILE
+from utils import get_cache_data, save_cache_data
+
+GC_DIR = os.path.join(os.path.dirname(CACHE_FILE), "gc")
+
+
+def _create_files(directory, count):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{i}.jpg")
+        with open(path, 'wb') as f:
+            f.write(b"x")
+        paths.append(path)
+    return paths
+
+
+def _reset_cache(paths):
+    save_cache_data({path: {"labels": "测试", "md5_path": f"{i}.jpg"} for i, path in enumerate(paths)})
+
+
+def _missing(paths):
+    cache = get_cache_data()
+    return sorted(path for path in paths if "missing_since" in cache.get(path, {}))
+
+
+def test_deleted_file_is_tombstoned():
+    paths = _create_files(os.path.join(GC_DIR, "deleted"), 4)
+    _reset_cache(paths)
+    os.remove(paths[0])
+
+    assert cache_gc.reconcile_all()["tombstoned_count"] == 1
+    assert _missing(paths) == [paths[0]]
+
+
+def test_empty_mount_point_is_not_tombstoned():
+    # 未挂载的网络存储通常只留下一个空的挂载点目录
+    mount_point = os.path.join(GC_DIR, "mount")
+    paths = _create_files(os.path.join(mount_point, "2024"), 3)
+    _reset_cache(paths)
+    shutil.rmtree(mount_point)
+    os.makedirs(mount_point)
+
+    assert cache_gc.reconcile_all()["tombstoned_count"] == 0
+    assert _missing(paths) == []
+
+
+def test_mostly_missing_batch_is_skipped():
+    directory = os.path.join(GC_DIR, "moved")
+    paths = _create_files(directory, 30)
+    _reset_cache(paths)
+    for path in paths[:20]:
+        os.remove(path)
+
+    assert cache_gc.reconcile_all()["tombstoned_count"] == 0
+    assert _missing(paths) == []
+
+
+def test_unmounted_root_is_not_tombstoned(monkeypatch):
+    root = os.path.join(GC_DIR, "share")
+    paths = _create_files(root, 2) + _create_files(os.path.join(GC_DIR, "other"), 1)
+    _reset_cache(paths)
+    monkeypatch.setattr(cache_gc, "IMAGE_ROOTS", [root])
+
+    # 第一次检查时图片目录是挂载点，之后挂载点消失但目录中仍有其他内容
+    monkeypatch.setattr(os.path, "ismount", lambda path: path == root)
+    cache_gc.reconcile_all()
+    monkeypatch.setattr(os.path, "ismount", lambda path: False)
+    for path in paths[:2]:
+        os.remove(path)
+    with open(os.path.join(root, "placeholder.txt"), 'w') as f:
+        f.write("not mounted")
+
+    assert cache_gc.reconcile_all()["tombstoned_count"] == 0
+    assert _missing(paths) == []
@@ -0,0 +1,62 @@
+"""
+缓存二进制快照测试：与cache.json的往返一致性
+"""
+import pytest
+import cache_snapshot
+from cache_snapshot import open_snapshot
+from utils import get_cache_data, save_cache_data, extract_image_tags
+
+
+def _cache(count):
+    cache = {}
+    for i in range(count):
+        cache[f"/images/相册/{i}.jpg"] = {
+            "labels": f"猫 狗{i}" if i % 2 else ["风景", "山"],
+            "md5_path": f"{i:032x}.jpg",
+            "token_usage": {"input_tokens": i, "output_tokens": 2 * i, "total_tokens": 3 * i,
+                            "input_tokens_details": {"image_tokens": i}},
+            "status": "success"
+        }
+        if i % 3 == 1:
+            cache[f"/images/相册/{i}.jpg"]["missing_since"] = 1700000000.5
+    return cache
+
+
+@pytest.mark.parametrize("count", [0, 1, 7])
+def test_round_trip(count):
+    cache = _cache(count)
+    save_cache_data(cache)
+    snapshot = open_snapshot()
+
+    assert snapshot is not None and len(snapshot) == count
+    assert snapshot.to_dict() == cache
+    assert list(snapshot.to_dict()) == list(cache)
+    assert get_cache_data() == cache
+    assert list(snapshot.md5_rows()) == [(path, data["md5_path"]) for path, data in cache.items()]
+    assert snapshot.missing_flags() == ["missing_since" in data for data in cache.values()]
+    for i, (image_path, md5_path, tags) in enumerate(snapshot.rows()):
+        data = cache[image_path]
+        assert md5_path == data["md5_path"]
+        assert tags == extract_image_tags(data["labels"])
+        assert snapshot[image_path] == data
+        assert snapshot.tokens(i)["image_tokens"] == data["token_usage"]["input_tokens_details"]["image_tokens"]
+    assert "/images/not-cached.jpg" not in snapshot
+
+
+def test_empty_cache_after_non_empty():
+    save_cache_data(_cache(3))
+    save_cache_data({})
+    assert get_cache_data() == {}
+
+
+def test_writer_releases_mapping_before_replace(monkeypatch):
+    # 模拟Windows：写入新快照前关闭本进程中打开的映射
+    monkeypatch.setattr(cache_snapshot, "MAPPED_FILES_LOCKED", True)
+    save_cache_data(_cache(2))
+    old = open_snapshot()
+    save_cache_data(_cache(4))
+
+    with pytest.raises(ValueError):
+        len(old.to_dict())
+    assert len(open_snapshot()) == 4
+    assert get_cache_data() == _cache(4)
@@ -0,0 +1,96 @@
+"""
+图片校验测试
+"""
+import os
+from PIL import Image
+import image_index
+from config import CACHE_FILE
+from image_index import read_image_metadata, validate_images
+
+IMAGE_DIR = os.path.join(os.path.dirname(CACHE_FILE), "validate")
+os.makedirs(IMAGE_DIR, exist_ok=True)
+
+
+def _save(name, size=(32, 32), image_format=None):
+    path = os.path.join(IMAGE_DIR, name)
+    Image.new("RGB", size, (120, 60, 30)).save(path, format=image_format)
+    return path
+
+
+def _append(path, data):
+    with open(path, 'ab') as f:
+        f.write(data)
+
+
+def _truncate(path, keep):
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:keep])
+
+
+def test_valid_images_pass():
+    for name in ("ok.jpg", "ok.png", "ok.gif", "ok.webp", "ok.bmp"):
+        metadata = read_image_metadata(_save(name))
+        assert "error" not in metadata and "warning" not in metadata, name
+        assert (metadata["width"], metadata["height"]) == (32, 32)
+
+
+def test_data_after_end_marker_is_accepted():
+    # 相机填充或动态照片附带的视频位于结束标记之后
+    padded = _save("padded.jpg")
+    _append(padded, b"\x00" * 16)
+    motion = _save("motion.jpg")
+    _append(motion, b"ftypmp42" + b"\x01" * 4096)
+    png = _save("padded.png")
+    _append(png, b"\x00" * 64)
+    for path in (padded, motion, png):
+        metadata = read_image_metadata(path)
+        assert "error" not in metadata and "warning" not in metadata, path
+
+
+def test_missing_end_marker_is_a_warning(monkeypatch):
+    truncated = _save("truncated.jpg", size=(256, 256))
+    _truncate(truncated, os.path.getsize(truncated) - 10)
+    metadata = read_image_metadata(truncated)
+    assert "error" not in metadata and "warning" in metadata
+
+    # 附加数据超出查找范围时同样只记录警告
+    monkeypatch.setattr(image_index, "END_MARKER_SEARCH_BYTES", 8)
+    long_tail = _save("long_tail.jpg")
+    _append(long_tail, b"\x01" * 64)
+    assert "warning" in read_image_metadata(long_tail)
+
+
+def test_unusable_images_are_rejected(monkeypatch):
+    empty = os.path.join(IMAGE_DIR, "empty.jpg")
+    open(empty, 'wb').close()
+    not_image = os.path.join(IMAGE_DIR, "text.jpg")
+    with open(not_image, 'w') as f:
+        f.write("not an image")
+    tiny = _save("tiny.png", size=(4, 4))
+    webp = _save("truncated.webp")
+    _truncate(webp, os.path.getsize(webp) - 8)
+    for path in (empty, not_image, tiny, webp):
+        assert "error" in read_image_metadata(path), path
+
+    # 像素数超过Pillow安全上限时抛出的DecompressionBombError不是OSError
+    bomb = _save("bomb.png", size=(64, 64))
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100)
+    assert "error" in read_image_metadata(bomb)
+
+
+def test_validate_images_filters_and_reuses_index():
+    good = _save("index_good.png")
+    bad = os.path.join(IMAGE_DIR, "index_bad.jpg")
+    with open(bad, 'w') as f:
+        f.write("broken")
+    missing = os.path.join(IMAGE_DIR, "missing.jpg")
+
+    valid, index = validate_images([good, bad, missing])
+    assert valid == [good]
+    assert "error" in index[bad] and missing not in index
+
+    # 文件未变化时直接使用索引中的元数据
+    valid, second = validate_images([good, bad])
+    assert valid == [good] and second[good] == index[good]
@@ -0,0 +1,110 @@
+"""
+分片扫描的多进程测试，使用桩函数代替模型调用
+"""
+import os
+import time
+from PIL import Image
+import shard_scan
+from config import CACHE_FILE, SHARD_LEASE_TTL
+from utils import get_cache_data, generate_md5_path
+from image_index import load_image_index
+
+WORK_DIR = os.path.dirname(CACHE_FILE)
+CALL_LOG = os.path.join(WORK_DIR, "calls.log")
+
+
+def stub_tagger(image_path):
+    """
+    模拟模型调用：记录调用并返回固定标签
+    """
+    with open(CALL_LOG, 'a', encoding='utf-8') as f:
+        f.write(image_path + "\n")
+    return {
+        "labels": "测试",
+        "token_usage": {"input_tokens": 10, "output_tokens": 2, "total_tokens": 12},
+        "md5_path": generate_md5_path(image_path),
+        "real_path": image_path,
+        "status": "success",
+        "mtime": int(os.path.getmtime(image_path))
+    }
+
+
+def _create_images(directory, count):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"image_{i}.png")
+        Image.new("RGB", (16, 16), (i * 10 % 256, 0, 0)).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_local_workers_tag_each_image_once():
+    image_dir = os.path.join(WORK_DIR, "images")
+    paths = _create_images(image_dir, 12)
+
+    summary = shard_scan.run_local_workers([image_dir], "multi", 3, process_fn=stub_tagger)
+
+    assert summary["merged_count"] == len(paths)
+    assert summary["total_tokens"] == 12 * len(paths)
+    with open(CALL_LOG, 'r', encoding='utf-8') as f:
+        calls = f.read().split()
+    assert sorted(calls) == sorted(paths)
+    cache = get_cache_data()
+    assert all(cache[path]["labels"] == "测试" for path in paths)
+    # 工作进程只写分片元数据，由合并步骤写入共享索引
+    image_index = load_image_index()
+    assert all(image_index[path]["width"] == 16 for path in paths)
+
+
+def test_acquire_lease_takes_over_expired_lease_only():
+    scan_dir = os.path.join(WORK_DIR, "leases_test")
+    shard_scan.init_scan(scan_dir, 1)
+
+    assert shard_scan.acquire_lease(scan_dir, 0, "a")
+    assert not shard_scan.acquire_lease(scan_dir, 0, "b")
+
+    expired = time.time() - SHARD_LEASE_TTL - 1
+    os.utime(shard_scan._lease_path(scan_dir, 0), (expired, expired))
+    assert shard_scan.acquire_lease(scan_dir, 0, "b")
+    assert not shard_scan.renew_lease(scan_dir, 0, "a")
+    assert shard_scan.renew_lease(scan_dir, 0, "b")
+
+
+def test_acquire_lease_restores_lease_renewed_before_rename(monkeypatch):
+    scan_dir = os.path.join(WORK_DIR, "renewed_test")
+    shard_scan.init_scan(scan_dir, 1)
+    assert shard_scan.acquire_lease(scan_dir, 0, "a")
+    lease_file = shard_scan._lease_path(scan_dir, 0)
+    expired = time.time() - SHARD_LEASE_TTL - 1
+    os.utime(lease_file, (expired, expired))
+
+    # 模拟持有者在过期检查之后、重命名之前续约
+    rename = os.rename
+
+    def renew_then_rename(src, dst):
+        assert shard_scan.renew_lease(scan_dir, 0, "a")
+        rename(src, dst)
+
+    monkeypatch.setattr(os, "rename", renew_then_rename)
+    assert not shard_scan.acquire_lease(scan_dir, 0, "b")
+    monkeypatch.undo()
+
+    assert shard_scan.renew_lease(scan_dir, 0, "a")
+    assert os.listdir(os.path.dirname(lease_file)) == ["0.lease"]
+
+
+def test_shard_worker_stops_at_scan_budget():
+    image_dir = os.path.join(WORK_DIR, "budget_images")
+    _create_images(image_dir, 5)
+    open(CALL_LOG, 'w').close()
+
+    # 每张图片12个token，预算只够处理两张
+    shard_scan.run_shard_worker([image_dir], "budget", 0, 1, process_fn=stub_tagger, scan_token_budget=30)
+
+    with open(CALL_LOG, 'r', encoding='utf-8') as f:
+        assert len(f.read().split()) == 2
+    scan_dir = os.path.join(shard_scan.SHARD_DIR, "budget")
+    assert not os.path.exists(os.path.join(scan_dir, "merged.json"))
+    summary = shard_scan.merge_shard_results("budget")
+    assert summary["merged_count"] == 2 and not summary["complete"]